@@ -1,12 +1,54 @@
+import hashlib
+import marshal
 import sys
+import tempfile
+from dataclasses import dataclass
 from logging import getLogger
 from pathlib import Path
 
-from yaml import YAMLError, dump, safe_load
+from yaml import YAMLError, dump, load
+
+# libyaml is much faster, but it isn't always available
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
 
 from easy_infra import __project_name__
 
 LOG = getLogger(__name__)
+# The parsed config, keyed by a digest of the config file contents and stored with marshal, which is much faster to load than YAML
+CONFIG_CACHE = Path(".cache").absolute().joinpath("config.marshal")
+
+
+def read_config_cache(*, digest: str) -> dict | None:
+    """Return the cached config if it was parsed from a config file with the provided digest"""
+    try:
+        cached_digest, config = marshal.loads(CONFIG_CACHE.read_bytes())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+
+    if cached_digest != digest:
+        return None
+
+    LOG.debug(f"Using the cached config from {CONFIG_CACHE}")
+    return config
+
+
+def write_config_cache(*, digest: str, config: dict) -> None:
+    """Cache the provided config, which was parsed from a config file with the provided digest"""
+    # Failing to cache the config is not an error
+    try:
+        data: bytes = marshal.dumps((digest, config))
+        CONFIG_CACHE.parent.mkdir(parents=True, exist_ok=True)
+        # Write then rename so that a concurrent reader never sees a partial cache
+        with tempfile.NamedTemporaryFile(
+            dir=CONFIG_CACHE.parent, suffix=".tmp", delete=False
+        ) as file:
+            file.write(data)
+        Path(file.name).replace(CONFIG_CACHE)
+    except (OSError, ValueError) as err:
+        LOG.debug(f"Unable to cache the config in {CONFIG_CACHE}: {str(err)}")
 
 
 def parse_config(*, config_file: Path) -> dict:
@@ -19,8 +61,12 @@ def parse_config(*, config_file: Path) -> dict:
         raise RuntimeError
 
     try:
-        with open(config_file) as yaml_data:
-            config = safe_load(yaml_data)
+        content: bytes = config_file.read_bytes()
+        digest: str = hashlib.sha256(content).hexdigest()
+        if (config := read_config_cache(digest=digest)) is not None:
+            return config
+
+        config = load(content, Loader=SafeLoader)
     except (
         YAMLError,
         FileNotFoundError,
@@ -36,16 +82,37 @@ def parse_config(*, config_file: Path) -> dict:
             raise err
         sys.exit(1)
 
+    write_config_cache(digest=digest, config=config)
+
+    return config
+
+
+def parse_config_text(*, text: str) -> dict:
+    """Parse the contents of an easy_infra config file, such as from a prior commit"""
+    try:
+        config = load(text, Loader=SafeLoader)
+    except YAMLError as err:
+        LOG.error(
+            f"The config was unable to be loaded due to the following exception: {str(err)}",
+        )
+        sys.exit(1)
+
     return config
 
 
 def write_config(*, config: dict, config_file: Path):
     """Write the easy_infra config file"""
+    text: str = dump(config)
     with open(config_file, "w", encoding="utf-8") as file:
-        dump(config, file)
+        file.write(text)
+
+    # Cache what was written, so that it doesn't need to be parsed again
+    write_config_cache(
+        digest=hashlib.sha256(text.encode("utf-8")).hexdigest(), config=config
+    )
 
 
-def update_config_file(*, package: str, version: str):
+def update_config_file(*, package: str, version: str, commit: str | None = None):
     """Update the easy_infra config file"""
     # Normalize
     package = package.split("/")[-1].lower()
@@ -58,7 +125,11 @@ def update_config_file(*, package: str, version: str):
     allow_update = config["packages"][package].get("allow_update", True)
     current_version = config["packages"][package]["version"]
 
-    if version == current_version:
+    # The commit is also recorded when it's missing, even if the version hasn't changed
+    if version == current_version and commit in (
+        None,
+        config["packages"][package].get("commit"),
+    ):
         LOG.debug(f"No new versions have been detected for {package}")
         return
 
@@ -69,5 +140,122 @@ def update_config_file(*, package: str, version: str):
         return
 
     config["packages"][package]["version"] = version
+    if commit:
+        config["packages"][package]["commit"] = commit
     LOG.info(f"Updating {package} to version {version}")
     write_config(config=config, config_file=config_file)
+
+
+@dataclass(frozen=True, slots=True)
+class Package:
+    """A package from the config file, along with its derived relationships"""
+
+    name: str
+    version: str | None
+    # The name of the tool that the package is built into an image for, if any
+    tool: str | None
+    # The commands that the package provides
+    aliases: tuple[str, ...]
+    security_tools: tuple[str, ...]
+    # The tools (or "all") that the package helps
+    helps: frozenset[str]
+    version_argument: str | None
+
+
+@dataclass(frozen=True, slots=True)
+class CompiledConfig:
+    """The config file compiled into packages and indexes, for O(1) lookups of their relationships"""
+
+    # The original structure, for the callers which need it
+    raw: dict
+    packages: dict[str, Package]
+    tools: frozenset[str]
+    environments: frozenset[str]
+    # Maps both the tool names and the package names to their package
+    tool_packages: dict[str, str]
+    # Maps each tool, package, and "all" to the packages which help it
+    helpers: dict[str, tuple[str, ...]]
+    # Maps each tool and package to its security tools
+    security_tools: dict[str, tuple[str, ...]]
+    environment_packages: dict[str, tuple[str, ...]]
+    alias_packages: dict[str, str]
+    # Maps each tool to the environments that it supports
+    tool_environments: dict[str, tuple[str, ...]]
+
+    def get_helpers(self, *, tool: str) -> tuple[str, ...]:
+        """Return the packages which help the provided tool, including the packages which help all tools"""
+        return tuple(
+            dict.fromkeys(
+                self.helpers.get(tool, ())
+                + self.helpers.get(self.tool_packages.get(tool, tool), ())
+                + self.helpers.get("all", ())
+            )
+        )
+
+
+def compile_config(*, config: dict) -> CompiledConfig:
+    """Compile the provided config into a CompiledConfig, deriving every relationship once"""
+    environment_packages: dict[str, tuple[str, ...]] = {
+        environment: tuple(settings["packages"])
+        for environment, settings in config["environments"].items()
+        if "packages" in settings
+    }
+    environments: frozenset[str] = frozenset(environment_packages)
+
+    packages: dict[str, Package] = {}
+    tool_packages: dict[str, str] = {}
+    helpers: dict[str, tuple[str, ...]] = {}
+    security_tools: dict[str, tuple[str, ...]] = {}
+    alias_packages: dict[str, str] = {}
+    tool_environments: dict[str, tuple[str, ...]] = {}
+    for name, settings in config["packages"].items():
+        tool_settings: dict = settings.get("tool", {})
+        # If there isn't a security configuration, the package isn't built into its own image, because then it wouldn't fit our secure by default
+        # design
+        tool: str | None = (
+            tool_settings.get("name", name)
+            if "security" in settings and "helper" not in settings
+            else None
+        )
+        package = Package(
+            name=name,
+            version=settings.get("version"),
+            tool=tool,
+            aliases=tuple(settings.get("aliases", [name])),
+            security_tools=tuple(settings.get("security", {})),
+            helps=frozenset(settings.get("helper", [])),
+            version_argument=settings.get("version_argument"),
+        )
+        packages[name] = package
+
+        tool_packages[name] = name
+        security_tools[name] = package.security_tools
+        for alias in package.aliases:
+            alias_packages[alias] = name
+        for helped in package.helps:
+            helpers[helped] = helpers.get(helped, ()) + (name,)
+
+        if tool:
+            tool_packages[tool] = name
+            security_tools[tool] = package.security_tools
+            # "none" is handled implicitly by the callers
+            tool_environments[tool] = tuple(
+                environment
+                for environment in tool_settings.get(
+                    "environments", sorted(environments)
+                )
+                if environment != "none"
+            )
+
+    return CompiledConfig(
+        raw=config,
+        packages=packages,
+        tools=frozenset(tool_environments),
+        environments=environments,
+        tool_packages=tool_packages,
+        helpers=helpers,
+        security_tools=security_tools,
+        environment_packages=environment_packages,
+        alias_packages=alias_packages,
+        tool_environments=tool_environments,
+    )
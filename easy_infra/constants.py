@@ -2,12 +2,11 @@
 easy_infra constants
 """
 
-import copy
 import json
+import sys
+import threading
 from pathlib import Path
-from typing import Union
-
-import git
+from typing import Callable, Union
 
 from easy_infra import __project_name__, __version__, config
 
@@ -17,37 +16,72 @@ FUNCTIONS_INPUT_FILE = BUILD.joinpath("functions.j2")
 FUNCTIONS_OUTPUT_FILE = BUILD.joinpath(FUNCTIONS_INPUT_FILE.with_suffix(".sh"))
 DOCKERFILE_INPUT_FILE = BUILD.joinpath("Dockerfile.j2")
 DOCKERFILE_OUTPUT_FILE = BUILD.joinpath("Dockerfile")
+# The build profile and size report of each image build
+REPORTS = CWD.joinpath("reports")
+# Each image is rendered into its own directory under WORKSPACES so that builds can run concurrently
+WORKSPACES = CWD.joinpath(".workspaces")
+# Minimal build context tarballs, keyed by the digest of their contents
+CACHE = CWD.joinpath(".cache")
+CONTEXTS = CACHE.joinpath("contexts")
+# Local BuildKit cache exports, one per bake target
+BUILDKIT_CACHE = CACHE.joinpath("buildkit")
+# Registry manifest lookups are cached by the digest that each tag points to, which is revalidated with a manifest HEAD request on every run
+MANIFEST_CACHE = CACHE.joinpath("manifests.json")
+# How long a cached lookup is trusted for when the tag can't be revalidated, such as when offline
+MANIFEST_CACHE_TTL = 3600
+MANIFEST_MEDIA_TYPES = [
+    "application/vnd.oci.image.index.v1+json",
+    "application/vnd.oci.image.manifest.v1+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.docker.distribution.manifest.v2+json",
+]
+REGISTRY_TIMEOUT = 10
+# When each easy_infra image was last used by a build, so that gc evicts the least recently used images first
+IMAGE_USAGE = CACHE.joinpath("images.json")
+# Historical build and test durations per image, used to balance the github actions matrix shards
+TIMINGS = CACHE.joinpath("timings.json")
+# How much weight the latest duration gets in the moving average, so that the timings follow changes without swinging on one slow run
+TIMINGS_WEIGHT = 0.5
+# The SBOM of each image, generated as a part of the build and keyed by the digest of the image's filesystem so that it is reused by every tag
+SBOMS = CACHE.joinpath("sboms")
+# The vulnerability scan results of each image, keyed by the same digest as the SBOMs along with the version of the vulnerability database
+VULNS = CACHE.joinpath("vulns")
+# How many images are scanned concurrently by default when generating the SBOMs or vuln scanning
+SCAN_JOBS = 4
+# How many images are pulled concurrently when prefetching
+PULL_JOBS = 4
+# How many images are pushed concurrently by default when publishing
+PUBLISH_JOBS = 4
+# The zstd compressed OCI layout archive that the images are exported to and imported from, to reuse them across CI jobs
+IMAGE_ARCHIVE = CWD.joinpath(f"{__project_name__}.oci.tar.zst")
+GC_MAX_SIZE_GB = 50
+GC_MAX_CACHE_SIZE_GB = 10
 
 LOG_DEFAULT = "INFO"
 IMAGE = f"seiso/{__project_name__}"
+BASE_IMAGE = f"seiso/{__project_name__}_base"
+# Helper binaries which seiso/easy_infra_base copies in, built once per version
+ARTIFACT_IMAGE = f"seiso/{__project_name__}_artifact"
+# Images are labeled with a digest of their build inputs so that unchanged images can be reused instead of rebuilt
+BUILD_DIGEST_LABEL = "com.seisollc.easy_infra.build-digest"
+# These buildargs change with every commit but only end up in metadata, so they are excluded from the build digest
+VOLATILE_BUILDARGS = {
+    "COMMIT_HASH",
+    "EASY_INFRA_TAG",
+    "EASY_INFRA_TAG_TOOL_ONLY",
+    "EASY_INFRA_VERSION",
+}
+# docker builds each image with the classic builder via the API, and bake builds all of them with one docker buildx bake
+BUILD_BACKENDS = {"docker", "bake"}
+# When baking, apt and pip download into BuildKit cache mounts which are shared by every target, and pruned down to this size after each bake
+CACHE_MOUNTS = "/var/cache/easy_infra"
+CACHE_MOUNTS_CONFIG = "cache-mounts"
+CACHE_MOUNTS_MAX_SIZE = "10gb"
 
-REPO = git.Repo(CWD)
-COMMIT_HASH = REPO.head.object.hexsha
-COMMIT_HASH_SHORT = REPO.git.rev_parse(COMMIT_HASH, short=True)
 CONFIG_FILE = Path(f"{__project_name__}.yml").absolute()
-CONFIG = config.parse_config(config_file=CONFIG_FILE)
 USERS = ["easy_infra", "root"]
-
-# TOOLS is used to create per-tool tags. If there isn't a security configuration, the tag will not be created, because then it wouldn't fit our secure
-# by default design
-TOOLS = set()
-for package in CONFIG["packages"]:
-    if (
-        "security" in CONFIG["packages"][package]
-        and "helper" not in CONFIG["packages"][package]
-    ):
-        if (
-            "tool" in CONFIG["packages"][package]
-            and "name" in CONFIG["packages"][package]["tool"]
-        ):
-            TOOLS.add(CONFIG["packages"][package]["tool"]["name"])
-        else:
-            TOOLS.add(package)
-
-ENVIRONMENTS = set()
-for environment in CONFIG["environments"]:
-    if "packages" in CONFIG["environments"][environment]:
-        ENVIRONMENTS.add(environment)
+# How long importing easy_infra.constants and easy_infra.utils may take, in seconds, which is checked by task check-imports
+IMPORT_TIME_BUDGET = 0.25
 
 LOG_FORMAT = json.dumps(
     {
@@ -73,62 +107,133 @@ GITHUB_REPOS_TAGS = {"aws/aws-cli"}
 PYTHON_PACKAGES = {"checkov"}
 HASHICORP_PROJECTS = {"terraform"}
 
-CONTEXT: dict[str, dict[str, Union[str, dict[str, Union[str, bool]]]]] = {}
-CONTEXT["buildargs_base"] = {"COMMIT_HASH": COMMIT_HASH}
-if (
-    f"v{__version__}" in REPO.tags
-    and REPO.tags[f"v{__version__}"].commit.hexsha == COMMIT_HASH
-):
-    CONTEXT["buildargs_base"]["EASY_INFRA_VERSION"] = __version__
-    RELEASE = True
-else:
-    CONTEXT["buildargs_base"][
-        "EASY_INFRA_VERSION"
-    ] = f"{__version__}-{COMMIT_HASH_SHORT}"
-    RELEASE = False
-
-# Note that there is no ":latest" tag accounted for in the TOOLS loop below
-for tool in TOOLS:
-    CONTEXT[tool] = {}
-    # Layer the tool-specific buildargs_base on top of the base buildargs_base
-    CONTEXT[tool]["buildargs_base"] = copy.deepcopy(CONTEXT["buildargs_base"])
-
-    # EASY_INFRA_TAG is a versioned tag which gets passed in at build time to populate an OCI annotation
-    if RELEASE:
-        CONTEXT[tool]["buildargs_base"]["EASY_INFRA_TAG"] = f"{__version__}-{tool}"
-        CONTEXT[tool]["versioned_tag"] = f"{__version__}-{tool}"
-        CONTEXT[tool]["latest_tag"] = f"latest-{tool}"
+# These constants read the git repo or the config file, so they are loaded on first access (see __getattr__) to keep importing this module side-effect
+# free. That way, calls which only need the config don't pay for git, and the other way around
+LAZY_LOCK = threading.RLock()
+
+
+def load_repo() -> dict:
+    """Load the constants which come from the git repo"""
+    # pylint: disable=import-outside-toplevel
+    import git
+
+    repo = git.Repo(CWD)
+    commit_hash = repo.head.object.hexsha
+
+    return {
+        "REPO": repo,
+        "COMMIT_HASH": commit_hash,
+        "COMMIT_HASH_SHORT": repo.git.rev_parse(commit_hash, short=True),
+    }
+
+
+def load_config() -> dict:
+    """Load the constants which come from the config file"""
+    config_data = config.parse_config(config_file=CONFIG_FILE)
+    compiled_config = config.compile_config(config=config_data)
+
+    # TOOLS is used to create per-tool tags. If there isn't a security configuration, the tag will not be created, because then it wouldn't fit our
+    # secure by default design
+    return {
+        "CONFIG": config_data,
+        "COMPILED_CONFIG": compiled_config,
+        "TOOLS": set(compiled_config.tools),
+        "ENVIRONMENTS": set(compiled_config.environments),
+    }
+
+
+def load_context() -> dict:
+    """Load the build context of every tool and environment"""
+    constants = sys.modules[__name__]
+    repo = constants.REPO
+    commit_hash = constants.COMMIT_HASH
+    commit_hash_short = constants.COMMIT_HASH_SHORT
+
+    context: dict[str, dict[str, Union[str, dict[str, Union[str, bool]]]]] = {}
+    context["buildargs_base"] = {"COMMIT_HASH": commit_hash}
+    if (
+        f"v{__version__}" in repo.tags
+        and repo.tags[f"v{__version__}"].commit.hexsha == commit_hash
+    ):
+        context["buildargs_base"]["EASY_INFRA_VERSION"] = __version__
+        release = True
     else:
-        CONTEXT[tool]["buildargs_base"][
-            "EASY_INFRA_TAG"
-        ] = f"{__version__}-{tool}-{COMMIT_HASH_SHORT}"
-        CONTEXT[tool]["versioned_tag"] = f"{__version__}-{tool}-{COMMIT_HASH_SHORT}"
-        CONTEXT[tool]["latest_tag"] = f"latest-{tool}-{COMMIT_HASH_SHORT}"
-
-    for environment in ENVIRONMENTS:
-        CONTEXT[tool][environment] = {}
-        CONTEXT[tool][environment]["buildargs_base"] = {}
-
-        # Layer the tool-environment buildargs_base on top of the tool buildargs_base
-        CONTEXT[tool][environment]["buildargs_base"] = copy.deepcopy(
-            CONTEXT[tool]["buildargs_base"]
-        )
-
-        if RELEASE:
-            CONTEXT[tool][environment][
-                "versioned_tag"
-            ] = f"{__version__}-{tool}-{environment}"
-            CONTEXT[tool][environment]["latest_tag"] = f"latest-{tool}-{environment}"
-            CONTEXT[tool][environment]["buildargs_base"][
-                "EASY_INFRA_TAG"
-            ] = f"{__version__}-{tool}-{environment}"
+        context["buildargs_base"][
+            "EASY_INFRA_VERSION"
+        ] = f"{__version__}-{commit_hash_short}"
+        release = False
+
+    # Note that there is no ":latest" tag accounted for in the TOOLS loop below
+    for tool in constants.TOOLS:
+        context[tool] = {}
+        # Layer the tool-specific buildargs_base on top of the base buildargs_base
+        context[tool]["buildargs_base"] = dict(context["buildargs_base"])
+
+        # EASY_INFRA_TAG is a versioned tag which gets passed in at build time to populate an OCI annotation
+        if release:
+            context[tool]["buildargs_base"]["EASY_INFRA_TAG"] = f"{__version__}-{tool}"
+            context[tool]["versioned_tag"] = f"{__version__}-{tool}"
+            context[tool]["latest_tag"] = f"latest-{tool}"
         else:
-            CONTEXT[tool][environment][
-                "versioned_tag"
-            ] = f"{__version__}-{tool}-{environment}-{COMMIT_HASH_SHORT}"
-            CONTEXT[tool][environment][
-                "latest_tag"
-            ] = f"latest-{tool}-{environment}-{COMMIT_HASH_SHORT}"
-            CONTEXT[tool][environment]["buildargs_base"][
+            context[tool]["buildargs_base"][
                 "EASY_INFRA_TAG"
-            ] = f"{__version__}-{tool}-{environment}-{COMMIT_HASH_SHORT}"
+            ] = f"{__version__}-{tool}-{commit_hash_short}"
+            context[tool]["versioned_tag"] = f"{__version__}-{tool}-{commit_hash_short}"
+            context[tool]["latest_tag"] = f"latest-{tool}-{commit_hash_short}"
+
+        for environment in constants.ENVIRONMENTS:
+            context[tool][environment] = {}
+            context[tool][environment]["buildargs_base"] = {}
+
+            # Layer the tool-environment buildargs_base on top of the tool buildargs_base
+            context[tool][environment]["buildargs_base"] = dict(
+                context[tool]["buildargs_base"]
+            )
+
+            if release:
+                context[tool][environment][
+                    "versioned_tag"
+                ] = f"{__version__}-{tool}-{environment}"
+                context[tool][environment][
+                    "latest_tag"
+                ] = f"latest-{tool}-{environment}"
+                context[tool][environment]["buildargs_base"][
+                    "EASY_INFRA_TAG"
+                ] = f"{__version__}-{tool}-{environment}"
+            else:
+                context[tool][environment][
+                    "versioned_tag"
+                ] = f"{__version__}-{tool}-{environment}-{commit_hash_short}"
+                context[tool][environment][
+                    "latest_tag"
+                ] = f"latest-{tool}-{environment}-{commit_hash_short}"
+                context[tool][environment]["buildargs_base"][
+                    "EASY_INFRA_TAG"
+                ] = f"{__version__}-{tool}-{environment}-{commit_hash_short}"
+
+    return {"CONTEXT": context, "RELEASE": release}
+
+
+LAZY_CONSTANTS: dict[str, Callable[[], dict]] = {
+    "REPO": load_repo,
+    "COMMIT_HASH": load_repo,
+    "COMMIT_HASH_SHORT": load_repo,
+    "CONFIG": load_config,
+    "COMPILED_CONFIG": load_config,
+    "TOOLS": load_config,
+    "ENVIRONMENTS": load_config,
+    "CONTEXT": load_context,
+    "RELEASE": load_context,
+}
+
+
+def __getattr__(name: str):
+    """Load the lazy constants on their first access; afterwards they are regular module attributes"""
+    if name not in LAZY_CONSTANTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    with LAZY_LOCK:
+        if name not in globals():
+            globals().update(LAZY_CONSTANTS[name]())
+
+    return globals()[name]
@@ -1,24 +1,74 @@
+from __future__ import annotations
+
+import calendar
 import copy
+import hashlib
+import heapq
+import importlib
+import io
 import json
 import os
 import platform
+import queue
 import re
 import shutil
 import subprocess
 import sys
+import tarfile
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from graphlib import TopologicalSorter
 from logging import DEBUG, basicConfig, getLogger
 from pathlib import Path
-from typing import Optional, Pattern
-
-import docker
-import requests
-from jinja2 import Environment, FileSystemLoader
+from types import ModuleType
+from typing import Callable, Iterator, Optional, Pattern
 
 from easy_infra import __project_name__, __version__, config, constants
-from tests import test as run_test
+
+
+class LazyModule(ModuleType):
+    """A module which is only imported once one of its attributes is used"""
+
+    def __getattr__(self, name: str):
+        # The import system locks each module while it's imported, so concurrent first uses are safe
+        value = getattr(importlib.import_module(self.__name__), name)
+        setattr(self, name, value)
+        return value
+
+
+# docker and requests make up most of the time it takes to import this module, but are only needed once a client is used or a request is made. The
+# annotations which reference them are deferred by the __future__ import
+docker = LazyModule("docker")  # pylint: disable=invalid-name
+requests = LazyModule("requests")  # pylint: disable=invalid-name
 
 LOG = getLogger(__project_name__)
-CLIENT = docker.from_env()
+# The docker engine that the current thread builds on, when builds are distributed across multiple engines; otherwise the engine from the environment
+# is used
+ENGINE = threading.local()
+# The clients of each engine by address, where the engine from the environment is "". Each client connects on first use rather than at import time
+ENGINES: dict[str, docker.DockerClient] = {}
+ENGINE_LOCK = threading.Lock()
+# Memoizes the seiso/easy_infra_base image and tag per engine and build digest for the duration of the run
+BASE_IMAGES: dict[tuple[str, str], str] = {}
+BASE_LOCKS: dict[str, threading.Lock] = {}
+# Memoizes the seiso/easy_infra_artifact images and tags per engine and build digest for the duration of the run
+ARTIFACT_IMAGES: dict[tuple[str, str], str] = {}
+ARTIFACT_LOCKS: dict[tuple[str, str], threading.Lock] = {}
+# Tracks the images which have been pulled (or attempted) per engine for the duration of the run, set once each pull finishes
+PULLED_IMAGES: dict[tuple[str, str, str], threading.Event] = {}
+PULL_LOCK = threading.Lock()
+MANIFEST_LOCK = threading.Lock()
+USAGE_LOCK = threading.Lock()
+TIMINGS_LOCK = threading.Lock()
+# Ensures that each SBOM is only generated once, even when the same filesystem is built concurrently
+SBOM_LOCKS: dict[str, threading.Lock] = {}
+SBOM_LOCK = threading.Lock()
+# Memoizes the version of the grype vulnerability database, which is only updated once per run
+VULNERABILITY_DB: dict[str, str] = {}
+VULNERABILITY_DB_LOCK = threading.Lock()
 
 basicConfig(level=constants.LOG_DEFAULT, format=constants.LOG_FORMAT)
 # Noise suppression
@@ -46,6 +96,49 @@ else:
     PLATFORM = f"{SYSTEM}/{MACHINE}"
 
 
+def get_local_client() -> docker.DockerClient:
+    """Return the client for the docker engine from the environment"""
+    with ENGINE_LOCK:
+        if "" not in ENGINES:
+            ENGINES[""] = docker.from_env()
+
+        return ENGINES[""]
+
+
+def get_client() -> docker.DockerClient:
+    """Return the client for the docker engine that the current thread builds on"""
+    if engine := get_engine():
+        return ENGINES[engine]
+
+    return get_local_client()
+
+
+def get_engine() -> str:
+    """Return the address of the engine that the current thread uses, where "" is the default"""
+    return getattr(ENGINE, "address", "")
+
+
+def get_engine_lock(*, locks: dict[str, threading.Lock]) -> threading.Lock:
+    """Return the lock for the current engine from the provided locks"""
+    with ENGINE_LOCK:
+        return locks.setdefault(get_engine(), threading.Lock())
+
+
+@contextmanager
+def use_engine(*, engine: str) -> Iterator[docker.DockerClient]:
+    """Run the docker operations of the current thread on the provided engine address"""
+    with ENGINE_LOCK:
+        if engine not in ENGINES:
+            ENGINES[engine] = docker.DockerClient(base_url=engine)
+
+    previous: str = get_engine()
+    ENGINE.address = engine
+    try:
+        yield ENGINES[engine]
+    finally:
+        ENGINE.address = previous
+
+
 def render_jinja2(
     *,
     template_file: Path,
@@ -54,16 +147,24 @@ def render_jinja2(
     output_mode: Optional[int] = None,
 ) -> None:
     """Render the functions file"""
-    folder = str(template_file.parent)
-    file = str(template_file.name)
-    LOG.info(f"Rendering {file}...")
-    template = Environment(loader=FileSystemLoader(folder)).get_template(file)
-    out = template.render(config)
+    LOG.info(f"Rendering {template_file.name}...")
+    out = render_template(template_file=template_file, config=config)
     output_file.write_text(out)
     if output_mode is not None:
         output_file.chmod(output_mode)
 
 
+def render_template(*, template_file: Path, config: dict) -> str:
+    """Render the provided template and return the result"""
+    # pylint: disable=import-outside-toplevel
+    from jinja2 import Environment, FileSystemLoader
+
+    folder = str(template_file.parent)
+    file = str(template_file.name)
+    template = Environment(loader=FileSystemLoader(folder)).get_template(file)
+    return template.render(config)
+
+
 def process_container(*, container: docker.models.containers.Container) -> None:
     """Process a provided container"""
     response = container.wait(condition="not-running")
@@ -85,9 +186,9 @@ def get_latest_release_from_apt(*, package: str) -> str:
     """Get the latest release of a project via apt"""
     # Needs to be an image with all the apt sources
     image = "seiso/easy_infra:latest-terraform-azure"
-    CLIENT.images.pull(repository=image)
+    get_client().images.pull(repository=image)
     command = f"/bin/bash -c \"apt-get update &>/dev/null && apt-cache policy {package} | grep '^  Candidate:' | awk -F' ' '{{print $NF}}'\""
-    release = CLIENT.containers.run(
+    release = get_client().containers.run(
         image=image,
         auto_remove=True,
         detach=False,
@@ -111,6 +212,12 @@ def get_latest_tag_from_github(*, repo: str) -> str:
     return response[0]["name"]
 
 
+def get_commit_from_github(*, repo: str, ref: str) -> str:
+    """Get the commit that a ref of a repo on github currently points to"""
+    response = requests.get(f"https://api.github.com/repos/{repo}/commits/{ref}").json()
+    return response["sha"]
+
+
 def get_latest_release_from_pypi(*, package: str) -> str:
     """Get the latest release of a package on pypi"""
     response = requests.get(f"https://pypi.org/pypi/{package}/json").json()
@@ -134,8 +241,8 @@ def get_latest_ubuntu_release() -> str:
     )
 
     # Ensure we have the latest "rolling"
-    CLIENT.images.pull(image)
-    container = CLIENT.containers.run(
+    get_client().images.pull(image)
+    container = get_client().containers.run(
         command=command,
         image=image,
         stdout=True,
@@ -200,10 +307,10 @@ def opinionated_docker_run(
         sys.exit(1)
 
     LOG.debug(
-        "Invoking CLIENT.containers.run() with the following arguments: "
+        "Invoking get_client().containers.run() with the following arguments: "
         + f"{auto_remove=}, {command=}, {detach=}, {environment=}, {image=}, {network_mode=}, {tty=}, {user=}, {volumes=}, {working_dir=}"
     )
-    container = CLIENT.containers.run(
+    container = get_client().containers.run(
         auto_remove=auto_remove,
         command=command,
         detach=detach,
@@ -224,7 +331,7 @@ def opinionated_docker_run(
             LOG.error(f'Encountered an unexpected error; logs were: {response["logs"]}')
             LOG.error(
                 f'Received an exit code of {response["StatusCode"]} when {expected_exit} was expected '
-                + "when invoking CLIENT.containers.run() with the following arguments: "
+                + "when invoking get_client().containers.run() with the following arguments: "
                 + f"{auto_remove=}, {command=}, {detach=}, {environment=}, {image=}, {network_mode=}, {tty=}, {user=}, {volumes=}, {working_dir=}"
             )
 
@@ -254,12 +361,95 @@ def is_status_expected(*, expected: int, response: dict) -> bool:
     return True
 
 
+def get_timing_key(*, tool: str, environment: str | None = None) -> str:
+    """Return the timing store key of the provided tool and environment"""
+    if environment and environment in constants.ENVIRONMENTS:
+        return f"{tool}-{environment}"
+
+    return tool
+
+
+def read_timings() -> dict[str, dict[str, float]]:
+    """Return the historical durations from the timing store, ignoring a missing or corrupt store"""
+    try:
+        return json.loads(constants.TIMINGS.read_text(encoding="UTF-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def record_timing(*, key: str, phase: str, duration: float) -> None:
+    """Record the duration of a phase of the provided image as a moving average"""
+    with TIMINGS_LOCK:
+        timings: dict[str, dict[str, float]] = read_timings()
+        previous: float | None = timings.setdefault(key, {}).get(phase)
+        if previous is not None:
+            duration = (
+                constants.TIMINGS_WEIGHT * duration
+                + (1 - constants.TIMINGS_WEIGHT) * previous
+            )
+        timings[key][phase] = round(duration, 3)
+        constants.TIMINGS.parent.mkdir(parents=True, exist_ok=True)
+        constants.TIMINGS.write_text(
+            json.dumps(timings, indent=2, sort_keys=True), encoding="UTF-8"
+        )
+
+
+def get_job_cost(
+    *, job: dict[str, str], timings: dict[str, dict[str, float]]
+) -> float | None:
+    """Return the estimated duration of the provided matrix job, if it was timed"""
+    durations: dict[str, float] = timings.get(
+        get_timing_key(tool=job["tool"], environment=job["environment"]), {}
+    )
+    phases: list[str] = ["build"]
+    if "user" in job:
+        phases.append(f"test-{job['user']}")
+    if any(phase not in durations for phase in phases):
+        return None
+
+    return sum(durations[phase] for phase in phases)
+
+
+def shard_jobs(*, jobs: list[dict[str, str]], shards: int) -> list[dict]:
+    """Balance the provided matrix jobs across the provided number of shards"""
+    timings: dict[str, dict[str, float]] = read_timings()
+    costs: list[float | None] = [get_job_cost(job=job, timings=timings) for job in jobs]
+    known: list[float] = [cost for cost in costs if cost is not None]
+    # Jobs which have never been timed are assumed to take the average time
+    default: float = sum(known) / len(known) if known else 1.0
+
+    # Ties are broken by the original order so that the shards are deterministic
+    heap: list[tuple[float, int]] = [
+        (0.0, shard) for shard in range(min(shards, len(jobs)))
+    ]
+    assigned: list[dict] = [{"cost": 0.0, "jobs": []} for _ in heap]
+    # Longest processing time first; each job goes to the shard with the lowest total cost so far
+    for index in sorted(
+        range(len(jobs)),
+        key=lambda index: (
+            -(costs[index] if costs[index] is not None else default),
+            index,
+        ),
+    ):
+        total, shard = heapq.heappop(heap)
+        cost: float = costs[index] if costs[index] is not None else default
+        assigned[shard]["jobs"].append(jobs[index])
+        assigned[shard]["cost"] = round(total + cost, 3)
+        heapq.heappush(heap, (total + cost, shard))
+
+    return [
+        {"shard": shard, "cost": contents["cost"], "jobs": contents["jobs"]}
+        for shard, contents in enumerate(assigned)
+    ]
+
+
 def get_github_actions_matrix(
     *,
     tool: str = "all",
     environment: str = "all",
     user: str = "all",
     testing: bool = False,
+    shards: int = 0,
 ) -> str:
     """Return a matrix of tool/environments or tool/environments/users for use in the github actions pipeline"""
     tools_and_environments: dict[str, dict[str, list[str]]] = (
@@ -287,6 +477,12 @@ def get_github_actions_matrix(
             else:
                 github_matrix["include"].append(job)
 
+    # Balance the jobs across a fixed number of shards using the timing store
+    if shards:
+        github_matrix["include"] = shard_jobs(
+            jobs=github_matrix["include"], shards=int(shards)
+        )
+
     include: str = json.dumps(github_matrix)
 
     if testing:
@@ -301,51 +497,11 @@ def get_supported_environments(*, tool: str) -> list[str]:
         LOG.error("This function must be passed a specific tool")
         sys.exit(1)
 
-    config = constants.CONFIG
-
-    # We need to scan all of the packages to see if the provided tool is a custom tool name
-    for package in config["packages"]:
-        # First, check to see if the provided tool matches the package name
-        if package == tool:
-            # See if there is a custom list of environments specified
-            if (
-                "tool" in config["packages"][package]
-                and "environments" in config["packages"][package]["tool"][tool]
-            ):
-                environments: list[str] = config["packages"][package]["tool"][
-                    "environments"
-                ]
-                break
-
-            # If there isn't a custom set of environments specified, default to all of them
-            environments: list[str] = list(constants.ENVIRONMENTS)
-            break
-
-        # Second, check if the provided tool is a custom tool name
-        if (
-            "tool" in config["packages"][package]
-            and "name" in config["packages"][package]["tool"]
-        ):
-            if (
-                tool == config["packages"][package]["tool"]["name"]
-                and "environments" in config["packages"][package]["tool"]
-            ):
-                environments: list[str] = config["packages"][package]["tool"][
-                    "environments"
-                ]
-                # Remove any explicit nones, they are handled implicitly upstream
-                if "none" in environments:
-                    environments.remove("none")
-                break
-
-            # If there isn't a custom set of environments specified, default to all of them
-            environments: list[str] = list(constants.ENVIRONMENTS)
-            break
-    else:
+    if (environments := constants.COMPILED_CONFIG.tool_environments.get(tool)) is None:
         LOG.error(f"Unable to identify the tool {tool} in the config")
         sys.exit(1)
 
-    return environments
+    return list(environments)
 
 
 def gather_tools_and_environments(
@@ -386,6 +542,156 @@ def gather_tools_and_environments(
     return image_and_tool_and_environment_tags
 
 
+def get_changes(*, changed_since: str) -> dict:
+    """Return the files, packages, and environments which changed since the provided git ref"""
+    # pylint: disable=import-outside-toplevel
+    import git
+
+    try:
+        files: set[str] = set(
+            constants.REPO.git.diff("--name-only", changed_since, "--").splitlines()
+        )
+        files.update(
+            constants.REPO.git.ls_files("--others", "--exclude-standard").splitlines()
+        )
+        prior_config: dict = config.parse_config_text(
+            text=constants.REPO.git.show(
+                f"{changed_since}:{constants.CONFIG_FILE.relative_to(constants.CWD)}"
+            )
+        )
+    except git.GitCommandError:
+        LOG.exception(f"Unable to compare the repository to {changed_since}")
+        sys.exit(1)
+
+    changes: dict = {"files": files, "everything": False}
+    for section in ("packages", "environments"):
+        current: dict = constants.CONFIG.get(section, {})
+        prior: dict = prior_config.get(section, {})
+        changes[section] = {
+            key
+            for key in set(current).union(prior)
+            if current.get(key) != prior.get(key)
+        }
+
+    # Any other change to easy_infra.yml may affect every image, except for the budgets which are only checked after a build
+    for section in set(constants.CONFIG).union(prior_config) - {
+        "packages",
+        "environments",
+        "budgets",
+    }:
+        if constants.CONFIG.get(section) != prior_config.get(section):
+            LOG.info(f"The {section} config changed since {changed_since}")
+            changes["everything"] = True
+
+    LOG.debug(f"Found the following changes since {changed_since}: {changes}")
+
+    return changes
+
+
+def get_image_inputs(*, tool: str, environment: str | None = None) -> dict:
+    """Return the packages and the repository files that the provided image is built from"""
+    buildargs: dict = setup_buildargs(tool=tool, environment=environment, trace=False)
+    # The buildargs already encode the helper, security, and environment relationships
+    packages: set[str] = {
+        package
+        for package in constants.CONFIG["packages"]
+        if package.upper().replace("-", "_") + "_VERSION" in buildargs
+    }
+
+    base_files: dict[str, Path] = get_context_files(
+        dockerfile=constants.BUILD.joinpath("Dockerfile.base").read_text(
+            encoding="UTF-8"
+        ),
+        dockerfile_name="Dockerfile.base",
+        contexts=[constants.BUILD],
+    )
+    files: set[Path] = set(base_files.values()).union(
+        {
+            constants.DOCKERFILE_INPUT_FILE,
+            constants.FUNCTIONS_INPUT_FILE,
+            constants.BUILD.joinpath("Dockerfile.restamp"),
+        }
+    )
+    for package in packages:
+        files.add(constants.BUILD.joinpath(f"Dockerfile.{package}"))
+        files.add(constants.BUILD.joinpath(f"Dockerfrag.{package}"))
+
+    if environment:
+        for key in {tool, get_package_name(tool=tool)}:
+            files.add(constants.BUILD.joinpath(f"Dockerfile.{key}-{environment}"))
+            files.add(constants.BUILD.joinpath(f"Dockerfrag.{key}-{environment}"))
+
+    return {
+        "packages": packages,
+        "files": {str(file.relative_to(constants.CWD)) for file in files},
+    }
+
+
+def is_image_changed(
+    *,
+    changes: dict,
+    tool: str,
+    environment: str | None = None,
+    include_tests: bool = False,
+) -> bool:
+    """Return True if the provided image is affected by the provided changes"""
+    # Changes to the build code may affect any image
+    global_prefixes: list[str] = [f"{__project_name__}/"]
+    if include_tests:
+        global_prefixes.append("tests/")
+
+    if changes["everything"] or any(
+        file.startswith(prefix)
+        for file in changes["files"]
+        for prefix in global_prefixes
+    ):
+        return True
+
+    if environment and environment in changes["environments"]:
+        return True
+
+    inputs: dict = get_image_inputs(tool=tool, environment=environment)
+    return bool(
+        inputs["packages"].intersection(changes["packages"])
+        or inputs["files"].intersection(changes["files"])
+    )
+
+
+def filter_changed_tools_and_environments(
+    *,
+    tools_to_environments: dict[str, dict[str, list[str]]],
+    changed_since: str,
+    include_tests: bool = False,
+) -> dict[str, dict]:
+    """Filter the provided tools_to_environments down to the images affected by the changes"""
+    changes: dict = get_changes(changed_since=changed_since)
+
+    filtered: dict[str, dict] = {}
+    for tool in tools_to_environments:
+        # The tool-only image is tracked separately from the {tool}-{environment} images
+        tool_only: bool = tools_to_environments[tool].get(
+            "tool_only", True
+        ) and is_image_changed(changes=changes, tool=tool, include_tests=include_tests)
+        environments: list[str] = [
+            environment
+            for environment in tools_to_environments[tool]["environments"]
+            if is_image_changed(
+                changes=changes,
+                tool=tool,
+                environment=environment,
+                include_tests=include_tests,
+            )
+        ]
+        if tool_only or environments:
+            filtered[tool] = {"environments": environments, "tool_only": tool_only}
+
+    LOG.info(
+        f"Found the following images with changes since {changed_since}: {filtered}"
+    )
+
+    return filtered
+
+
 def gather_users(*, user: str) -> list[str]:
     """Return a list of users, based on the simplified provided user"""
     if user == "all":
@@ -411,6 +717,14 @@ def get_image_and_tag(*, tool: str, environment: str | None = None) -> str:
     return image_and_tag
 
 
+def get_latest_tag(*, tool: str, environment: str | None = None) -> str:
+    """Return the latest tag for the given tool and environment"""
+    if environment and environment in constants.ENVIRONMENTS:
+        return constants.CONTEXT[tool][environment]["latest_tag"]
+
+    return constants.CONTEXT[tool]["latest_tag"]
+
+
 def get_tags(
     *, tools_to_environments: dict, environment: str, only_versioned: bool = False
 ) -> list[str]:
@@ -421,7 +735,9 @@ def get_tags(
     latest_tags = []
     for tool in tools_to_environments:
         # Add the tool-only tags only when a single environment isn't provided
-        if environment not in constants.ENVIRONMENTS:
+        if environment not in constants.ENVIRONMENTS and tools_to_environments[
+            tool
+        ].get("tool_only", True):
             versioned_tags.append(constants.CONTEXT[tool]["versioned_tag"])
             latest_tags.append(constants.CONTEXT[tool]["latest_tag"])
 
@@ -470,43 +786,174 @@ def update_terraform_required_version(*, test_file: Path, version: str) -> None:
 
 def get_package_name(*, tool: str) -> str:
     """Return the package name for the provided tool"""
-    for package in constants.CONFIG["packages"]:
-        if package == tool:
-            return package
+    if (package := constants.COMPILED_CONFIG.tool_packages.get(tool)) is None:
+        LOG.error(f"Unable to find the package for tool {tool}")
+        sys.exit(1)
 
-        if (
-            "tool" in constants.CONFIG["packages"][package]
-            and "name" in constants.CONFIG["packages"][package]["tool"]
-            and tool in constants.CONFIG["packages"][package]["tool"]["name"]
-        ):
-            return package
+    return package
+
+
+def read_manifest_cache() -> dict:
+    """Return the cached registry manifest lookups, ignoring a missing or corrupt cache"""
+    try:
+        return json.loads(constants.MANIFEST_CACHE.read_text(encoding="UTF-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def get_manifest_digest(*, image_and_tag: str) -> str:
+    """Return the digest that the provided tag currently points to in its registry"""
+    # A manifest HEAD request is cheap and doesn't count towards the registry's pull rate limits
+    repository, tag = image_and_tag.rsplit(":", 1)
+    registry, _, path = repository.partition("/")
+    if not path or (
+        "." not in registry and ":" not in registry and registry != "localhost"
+    ):
+        registry, path = "docker.io", repository
+    if registry == "docker.io":
+        registry = "registry-1.docker.io"
+        path = path if "/" in path else f"library/{path}"
+
+    url: str = f"https://{registry}/v2/{path}/manifests/{tag}"
+    headers: dict[str, str] = {"Accept": ", ".join(constants.MANIFEST_MEDIA_TYPES)}
+    response = requests.head(url, headers=headers, timeout=constants.REGISTRY_TIMEOUT)
+
+    # Public registries hand out anonymous pull tokens, anything else falls back to the docker daemon's credentials
+    challenge: str = response.headers.get("WWW-Authenticate", "")
+    if response.status_code == 401 and challenge.startswith("Bearer "):
+        params: dict[str, str] = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+        token: dict = requests.get(
+            params.pop("realm"), params=params, timeout=constants.REGISTRY_TIMEOUT
+        ).json()
+        headers["Authorization"] = (
+            f"Bearer {token.get('token') or token.get('access_token')}"
+        )
+        response = requests.head(
+            url, headers=headers, timeout=constants.REGISTRY_TIMEOUT
+        )
+
+    response.raise_for_status()
+    return response.headers["Docker-Content-Digest"]
+
+
+def get_registry_digest(*, image_and_tag: str, platform: str = PLATFORM) -> str | None:
+    """Return the registry digest of the provided image, or None if it lacks the provided platform"""
+    key: str = f"{image_and_tag} {platform}"
+    try:
+        current: str | None = get_manifest_digest(image_and_tag=image_and_tag)
+    except (requests.exceptions.RequestException, KeyError) as error:
+        LOG.debug(f"Unable to revalidate {image_and_tag} with its registry: {error}")
+        current = None
+
+    with MANIFEST_LOCK:
+        manifests: dict = read_manifest_cache()
+
+    # The platforms of a digest never change, so a cached lookup is reused for as long as the tag still points to it, and the TTL
+    # only applies when the tag couldn't be revalidated
+    manifest: dict = manifests.get(key, {})
+    if current:
+        cached: bool = manifest.get("tag_digest") == current
+    else:
+        cached = bool(manifest) and (
+            time.time() - manifest["checked"] < constants.MANIFEST_CACHE_TTL
+        )
+
+    if cached:
+        LOG.debug(f"Using the cached registry data for {image_and_tag}")
+        return manifest["digest"]
+
+    # Raises docker.errors.NotFound if the image isn't in the registry
+    registry_data = get_client().images.get_registry_data(name=image_and_tag)
+    digest: str | None = (
+        registry_data.id if registry_data.has_platform(platform) else None
+    )
+
+    with MANIFEST_LOCK:
+        manifests = read_manifest_cache()
+        manifests[key] = {
+            "tag_digest": registry_data.id,
+            "digest": digest,
+            "checked": time.time(),
+        }
+        constants.MANIFEST_CACHE.parent.mkdir(parents=True, exist_ok=True)
+        constants.MANIFEST_CACHE.write_text(
+            json.dumps(manifests, indent=2, sort_keys=True), encoding="UTF-8"
+        )
+
+    return digest
 
-    LOG.error(f"Unable to find the package for tool {tool}")
-    sys.exit(1)
+
+def is_image_current(*, image_and_tag: str, digest: str) -> bool:
+    """Return True if the local copy of the provided image was pulled from the provided registry digest"""
+    try:
+        image = get_client().images.get(image_and_tag)
+    except docker.errors.ImageNotFound:
+        return False
+
+    return any(
+        repo_digest.endswith(f"@{digest}")
+        for repo_digest in image.attrs.get("RepoDigests", [])
+    )
 
 
 def pull_image(*, image_and_tag: str, platform: str = PLATFORM) -> None:
     """Pull the provided image but continue if it fails"""
+    # Each image is only pulled once per run, and not at all if the local copy is current
+    key: tuple[str, str, str] = (get_engine(), image_and_tag, platform)
+    with PULL_LOCK:
+        if (pulling := PULLED_IMAGES.get(key)) is None:
+            PULLED_IMAGES[key] = threading.Event()
+
+    # Another thread is already pulling it, so wait for that pull rather than starting a build without the image
+    if pulling is not None:
+        pulling.wait()
+        return
+
     try:
-        registry_data = CLIENT.images.get_registry_data(name=f"{image_and_tag}")
+        try:
+            digest: str | None = get_registry_digest(
+                image_and_tag=image_and_tag, platform=platform
+            )
 
-        if registry_data.has_platform(platform):
-            LOG.info(f"Pulling {image_and_tag} (platform {platform})...")
-        else:
-            LOG.info(f"{image_and_tag} does not have a {platform} image available")
+            if not digest:
+                LOG.info(f"{image_and_tag} does not have a {platform} image available")
+                return
+        except docker.errors.NotFound:
+            LOG.error(
+                f"Unable to find {image_and_tag} registry data, not going to attempt to pull the image but continuing anyway..."
+            )
             return
-    except docker.errors.NotFound:
-        LOG.error(
-            f"Unable to find {image_and_tag} registry data, not going to attempt to pull the image but continuing anyway..."
-        )
+
+        if is_image_current(image_and_tag=image_and_tag, digest=digest):
+            LOG.info(f"{image_and_tag} (platform {platform}) is already up to date")
+            return
+
+        LOG.info(f"Pulling {image_and_tag} (platform {platform})...")
+        try:
+            get_client().images.pull(repository=image_and_tag, platform=platform)
+        except requests.exceptions.HTTPError:
+            LOG.warning(
+                f"Failed to pull {image_and_tag} for platform {platform} due to an HTTP error, continuing anyway..."
+            )
+    finally:
+        PULLED_IMAGES[key].set()
+
+
+def prefetch_images(*, images_and_tags: list[str]) -> None:
+    """Pull the provided images concurrently, ahead of the builds which use them as a cache"""
+    if not images_and_tags:
         return
 
-    try:
-        CLIENT.images.pull(repository=image_and_tag, platform=platform)
-    except requests.exceptions.HTTPError:
-        LOG.warning(
-            f"Failed to pull {image_and_tag} for platform {platform} due to an HTTP error, continuing anyway..."
-        )
+    LOG.info(f"Prefetching {images_and_tags}...")
+    with ThreadPoolExecutor(
+        max_workers=min(len(images_and_tags), constants.PULL_JOBS),
+        thread_name_prefix="pull",
+    ) as executor:
+        for future in [
+            executor.submit(pull_image, image_and_tag=image_and_tag)
+            for image_and_tag in images_and_tags
+        ]:
+            future.result()
 
 
 def update(debug=False) -> None:
@@ -523,7 +970,11 @@ def update(debug=False) -> None:
 
     for repo in constants.GITHUB_REPOS_RELEASES:
         version = get_latest_release_from_github(repo=repo)
-        config.update_config_file(package=repo, version=version)
+        # Packages which are built from source record the commit of their version, for reproducible builds
+        commit: str | None = None
+        if get_commit_arg(package=repo.split("/")[-1].lower()):
+            commit = get_commit_from_github(repo=repo, ref=version)
+        config.update_config_file(package=repo, version=version, commit=commit)
 
     for repo in constants.GITHUB_REPOS_TAGS:
         version = get_latest_tag_from_github(repo=repo)
@@ -543,29 +994,15 @@ def update(debug=False) -> None:
         config.update_config_file(package=package, version=version)
 
 
-def filter_config(*, config: str, tools: list[str]) -> dict:
-    """Take in a configuration, filter it based on the provided tool, and return the result"""
+def filter_config(*, config: dict, tools: list[str]) -> dict:
+    """Take in a configuration, filter it based on the provided tools, and return the result"""
     filtered_config = {}
     filtered_config["packages"] = {}
 
-    # Preload all of the packages with a custom "tool" name specified
-    custom_tool: dict[str, str] = {}
-    for package in config["packages"]:
-        if (
-            "tool" in config["packages"][package]
-            and "name" in config["packages"][package]["tool"]
-        ):
-            tool: str = config["packages"][package]["tool"]["name"]
-            custom_tool[tool]: str = package
-
     for tool in tools:
-        if tool in custom_tool:
-            package: str = custom_tool[tool]
-            filtered_config["packages"][package] = copy.deepcopy(
-                config["packages"][package]
-            )
-        else:
-            filtered_config["packages"][tool] = copy.deepcopy(config["packages"][tool])
+        package: str = constants.COMPILED_CONFIG.tool_packages.get(tool, tool)
+        # The packages are shared rather than copied, so the result must be treated as read-only
+        filtered_config["packages"][package] = config["packages"][package]
 
     LOG.debug(f"Returning a filtered config of {filtered_config}")
 
@@ -574,36 +1011,45 @@ def filter_config(*, config: str, tools: list[str]) -> dict:
 
 def add_version_to_buildarg(*, buildargs: dict, thing: str) -> str:
     """Add the version to the buildarg as a crafted key value pair"""
-    # Look up the correct package
-    if thing not in constants.CONFIG["packages"]:
-        for package in constants.CONFIG["packages"]:
-            if (
-                "tool" in constants.CONFIG["packages"][package]
-                and "name" in constants.CONFIG["packages"][package]["tool"]
-            ):
-                looked_up_package: str = package
-                break
-        else:
-            LOG.error(
-                f"Unable to find {thing} in the packages or tool names of the config"
-            )
-            sys.exit(1)
-    else:
-        # the thing provided is a package
-        looked_up_package: str = thing
+    # Look up the correct package, since the thing may be a custom tool name
+    if (
+        looked_up_package := constants.COMPILED_CONFIG.tool_packages.get(thing)
+    ) is None:
+        LOG.error(f"Unable to find {thing} in the packages or tool names of the config")
+        sys.exit(1)
 
     # Then extract the version
-    if "version" in constants.CONFIG["packages"][looked_up_package]:
-        # Normalize and add to buildargs
-        arg: str = looked_up_package.upper().replace("-", "_") + "_VERSION"
-        buildargs[arg] = constants.CONFIG["packages"][looked_up_package]["version"]
-    else:
+    if (
+        version := constants.COMPILED_CONFIG.packages[looked_up_package].version
+    ) is None:
         LOG.error(f"Unable to identify the version of {looked_up_package}")
         sys.exit(1)
 
+    # Normalize and add to buildargs
+    arg: str = looked_up_package.upper().replace("-", "_") + "_VERSION"
+    buildargs[arg] = version
+
     return looked_up_package
 
 
+def read_image_usage() -> dict[str, float]:
+    """Return when each image was last used by a build, ignoring a missing or corrupt record"""
+    try:
+        return json.loads(constants.IMAGE_USAGE.read_text(encoding="UTF-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def record_image_use(*, image_and_tag: str) -> None:
+    """Record that the provided image was used by a build, so that gc considers it recently used"""
+    image_id: str = get_client().images.get(image_and_tag).id
+    with USAGE_LOCK:
+        usage: dict[str, float] = read_image_usage()
+        usage[image_id] = time.time()
+        constants.IMAGE_USAGE.parent.mkdir(parents=True, exist_ok=True)
+        constants.IMAGE_USAGE.write_text(json.dumps(usage, indent=2), encoding="UTF-8")
+
+
 def log_build_log(*, build_err: docker.errors.BuildError) -> None:
     """Log the docker build log"""
     iterator = iter(build_err.build_log)
@@ -624,6 +1070,140 @@ def log_build_log(*, build_err: docker.errors.BuildError) -> None:
             finished = True
 
 
+def start_image_build(*, build_kwargs: dict) -> Iterator[dict]:
+    """Send the build context to the docker daemon and return the build log stream"""
+    return get_client().api.build(decode=True, **build_kwargs)
+
+
+def get_layer_sizes(*, image: docker.models.images.Image) -> dict[str, int]:
+    """Return the size of each layer of the provided image, keyed by its short ID"""
+    layer_sizes: dict[str, int] = {}
+    for layer in get_client().api.history(image.id):
+        if layer["Id"] != "<missing>":
+            layer_sizes[layer["Id"].removeprefix("sha256:")[:12]] = layer["Size"]
+
+    return layer_sizes
+
+
+def write_build_profile(
+    *,
+    image_and_tag: str,
+    steps: list[dict],
+    duration: float,
+    image: docker.models.images.Image | None = None,
+) -> Path:
+    """Write a JSON profile of an image build, with the duration, cache usage, and layer size of each step"""
+    layer_sizes: dict[str, int] = get_layer_sizes(image=image) if image else {}
+    for step in steps:
+        step["size"] = layer_sizes.get(step["layer"])
+
+    profile: dict = {
+        "image": image_and_tag,
+        "platform": PLATFORM,
+        "succeeded": image is not None,
+        "duration": round(duration, 3),
+        "size": image.attrs["Size"] if image else None,
+        "steps": steps,
+    }
+    constants.REPORTS.mkdir(parents=True, exist_ok=True)
+    profile_file: Path = constants.REPORTS.joinpath(
+        f"profile.{image_and_tag.rsplit(':', 1)[-1]}.json"
+    )
+    profile_file.write_text(json.dumps(profile, indent=2) + "\n", encoding="UTF-8")
+    LOG.debug(f"Wrote the build profile for {image_and_tag} to {profile_file}")
+
+    return profile_file
+
+
+def finish_image_build(
+    *, build_log: Iterator[dict], image_and_tag: str
+) -> docker.models.images.Image:
+    """Consume the provided build log stream as it arrives and return the built image"""
+    # This mirrors docker.models.images.ImageCollection.build, but logs progress live and always writes a profile
+    image_id = None
+    last_event = None
+    seen: list[dict] = []
+    steps: list[dict] = []
+    start = step_start = time.monotonic()
+    for chunk in build_log:
+        seen.append(chunk)
+        if "error" in chunk:
+            if steps:
+                steps[-1]["duration"] = round(time.monotonic() - step_start, 3)
+            write_build_profile(
+                image_and_tag=image_and_tag,
+                steps=steps,
+                duration=time.monotonic() - start,
+            )
+            raise docker.errors.BuildError(chunk["error"], seen)
+        if "stream" in chunk:
+            for line in chunk["stream"].splitlines():
+                if match := re.match(r"^Step (\d+)/(\d+) : (.+)$", line):
+                    now = time.monotonic()
+                    if steps:
+                        steps[-1]["duration"] = round(now - step_start, 3)
+                    step_start = now
+                    steps.append(
+                        {
+                            "step": int(match.group(1)),
+                            "instruction": match.group(3),
+                            "duration": None,
+                            "cached": False,
+                            "layer": None,
+                        }
+                    )
+                    LOG.info(f"{image_and_tag}: {line}")
+                elif steps and line.strip() == "---> Using cache":
+                    steps[-1]["cached"] = True
+                    LOG.debug(f"{image_and_tag}: {line}")
+                elif steps and (match := re.match(r"^ ---> ([0-9a-f]{12})$", line)):
+                    steps[-1]["layer"] = match.group(1)
+                    LOG.debug(f"{image_and_tag}: {line}")
+                elif line.strip():
+                    LOG.debug(f"{image_and_tag}: {line}")
+
+            if match := re.search(
+                r"(^Successfully built |sha256:)([0-9a-f]+)$", chunk["stream"]
+            ):
+                image_id = match.group(2)
+        last_event = chunk
+
+    if steps:
+        steps[-1]["duration"] = round(time.monotonic() - step_start, 3)
+
+    if image_id:
+        image = get_client().images.get(image_id)
+        write_build_profile(
+            image_and_tag=image_and_tag,
+            steps=steps,
+            duration=time.monotonic() - start,
+            image=image,
+        )
+        return image
+
+    write_build_profile(
+        image_and_tag=image_and_tag, steps=steps, duration=time.monotonic() - start
+    )
+    raise docker.errors.BuildError(last_event or "Unknown", seen)
+
+
+def build_image(*, build_kwargs: dict) -> docker.models.images.Image:
+    """Build an image, returning the built image or raising a docker.errors.BuildError"""
+    build_log = start_image_build(build_kwargs=build_kwargs)
+    return finish_image_build(build_log=build_log, image_and_tag=build_kwargs["tag"])
+
+
+@contextmanager
+def build_workspace(*, name: str) -> Iterator[Path]:
+    """Yield a private directory to render files into, which is removed afterwards"""
+    constants.WORKSPACES.mkdir(parents=True, exist_ok=True)
+    # Unique even across processes, so concurrent builds don't overwrite each other's rendered files
+    with tempfile.TemporaryDirectory(
+        prefix=f"{name}.", dir=constants.WORKSPACES
+    ) as directory:
+        yield Path(directory)
+
+
 def log_image_build(*, build_kwargs: dict) -> None:
     """Log image build information"""
     # If we aren't running at least in debug we can just drop an info log and return
@@ -633,12 +1213,13 @@ def log_image_build(*, build_kwargs: dict) -> None:
 
     # Build out a CLI command that we can use when troubleshooting issues with the Python build process
 
-    # Required: buildargs, dockerfile, path, platform (may be None), rm (may be False), tag, target
-    # Optional: cache_from (list), pull (may be False)
+    # Required: buildargs, dockerfile, path or fileobj, platform (may be None), rm (may be False), tag, target
+    # Optional: cache_from (list), labels (dict), pull (may be False)
 
     # Defaults for the optional items
     pull = False
     cache_from = ""
+    labels = ""
     for key in build_kwargs:
         match key:
             case "buildargs":
@@ -646,9 +1227,15 @@ def log_image_build(*, build_kwargs: dict) -> None:
                 for arg in build_kwargs[key]:
                     buildargs += f"--build-arg {arg}={build_kwargs[key][arg]} "
             case "dockerfile":
-                dockerfile = f"--file {build_kwargs['path']}/{build_kwargs[key]}"
+                if "path" in build_kwargs:
+                    dockerfile = f"--file {build_kwargs['path']}/{build_kwargs[key]}"
+                else:
+                    dockerfile = f"--file {build_kwargs[key]}"
             case "path":
                 path = build_kwargs[key]
+            case "fileobj":
+                # A custom context is sent as a tarball on stdin
+                path = f"- < {build_kwargs[key].name}"
             case "platform":
                 if build_kwargs[key]:
                     platform = f"--platform {build_kwargs[key]}"
@@ -670,15 +1257,45 @@ def log_image_build(*, build_kwargs: dict) -> None:
                 cache_from = str()
                 for image_and_tag in build_kwargs[key]:
                     cache_from += f"--cache-from {image_and_tag} "
+            case "labels":
+                labels = str()
+                for label in build_kwargs[key]:
+                    labels += f"--label {label}={build_kwargs[key][label]} "
 
     if pull:
         LOG.debug(f"Running the equivalent of `docker pull {build_kwargs['tag']}`")
 
     LOG.debug(
-        f"Running the equivalent of `docker build {rm} {buildargs} {target} {cache_from} {tag} {platform} {dockerfile} {path}`"
+        f"Running the equivalent of `docker build {rm} {buildargs} {target} {cache_from} {labels} {tag} {platform} {dockerfile} {path}`"
     )
 
 
+def add_platform_to_buildargs(*, buildargs: dict) -> None:
+    """Add the platform-based build args (imperfect)"""
+    if platform.machine().lower() == "arm64":
+        buildargs["BUILDARCH"] = "arm64"
+        buildargs["AWS_CLI_ARCH"] = "aarch64"
+    else:
+        buildargs["BUILDARCH"] = "amd64"
+        buildargs["AWS_CLI_ARCH"] = "x86_64"
+
+
+def setup_base_buildargs(*, trace: bool) -> dict:
+    """Setup the buildargs for seiso/easy_infra_base"""
+    buildargs = {}
+
+    if trace:
+        LOG.debug("Setting trace in the buildargs...")
+        buildargs["TRACE"] = "true"
+
+    add_platform_to_buildargs(buildargs=buildargs)
+
+    for package in constants.COMPILED_CONFIG.helpers.get("all", ()):
+        add_version_to_buildarg(buildargs=buildargs, thing=package)
+
+    return buildargs
+
+
 def setup_buildargs(*, tool: str, environment: str | None = None, trace: bool) -> dict:
     """Setup the buildargs for the provided tool"""
     buildargs = {}
@@ -687,138 +1304,625 @@ def setup_buildargs(*, tool: str, environment: str | None = None, trace: bool) -
         LOG.debug("Setting trace in the buildargs...")
         buildargs["TRACE"] = "true"
 
-    # Add the platform-based build args (imperfect)
-    if platform.machine().lower() == "arm64":
-        buildargs["BUILDARCH"] = "arm64"
-        buildargs["AWS_CLI_ARCH"] = "aarch64"
-    else:
-        buildargs["BUILDARCH"] = "amd64"
-        buildargs["AWS_CLI_ARCH"] = "x86_64"
+    add_platform_to_buildargs(buildargs=buildargs)
 
     # Add the tool version buildarg
     looked_up_package: str = add_version_to_buildarg(buildargs=buildargs, thing=tool)
 
-    # Pull in any other buildargs that the tool cares about
-    for package in constants.CONFIG["packages"]:
-        if (
-            # Include all packages that are referenced in the tool's security section
-            package in constants.CONFIG["packages"][looked_up_package]["security"]
-            # Include the versions of packages which "help" other tools
-            or (
-                "helper" in constants.CONFIG["packages"][package]
-                and set(constants.CONFIG["packages"][package]["helper"]).intersection(
-                    {tool, "all"}
-                )
-            )
-        ):
-            add_version_to_buildarg(buildargs=buildargs, thing=package)
+    # Pull in any other buildargs that the tool cares about; the packages that are referenced in the tool's security section, and the versions of
+    # packages which "help" the tool
+    compiled_config: config.CompiledConfig = constants.COMPILED_CONFIG
+    for package in dict.fromkeys(
+        compiled_config.packages[looked_up_package].security_tools
+        + compiled_config.get_helpers(tool=tool)
+    ):
+        add_version_to_buildarg(buildargs=buildargs, thing=package)
 
     # Finally, add in buildargs for the related environment
     if environment:
-        for package in constants.CONFIG["environments"][environment]["packages"]:
+        for package in compiled_config.environment_packages[environment]:
             add_version_to_buildarg(buildargs=buildargs, thing=package)
 
     return buildargs
 
 
-def build_and_tag(
-    *, tool: str, environment: str | None = None, trace: bool = False
-) -> None:
-    """Build the provided image and tag it with the provided list of tags"""
-    # Input validation
-    if tool not in constants.TOOLS:
-        LOG.error(f"Provided an invalid tool of {tool}")
-        sys.exit(1)
+def get_context_files(
+    *, dockerfile: str, dockerfile_name: str, contexts: list[Path]
+) -> dict[str, Path]:
+    """Return the files in the build context of the provided Dockerfile, keyed by their path in it"""
+    files: dict[str, Path] = {}
+    # Join any line continuations so that each instruction is on a single line
+    for instruction in re.sub(r"\\\n", " ", dockerfile).splitlines():
+        if not (
+            match := re.match(r"^\s*(COPY|ADD)\s+(.+)$", instruction, re.IGNORECASE)
+        ):
+            continue
 
-    if environment and environment not in constants.ENVIRONMENTS:
-        LOG.error(f"Provided an invalid environment of {environment}")
+        arguments: list[str] = match.group(2).split()
+        if any(argument.startswith("--from=") for argument in arguments):
+            continue
+
+        # The last argument is the destination, and flags such as --chown are not sources
+        sources: list[str] = [
+            argument for argument in arguments[:-1] if not argument.startswith("--")
+        ]
+        for source in sources:
+            # Earlier contexts take precedence
+            for context in reversed(contexts):
+                for path in context.glob(source.strip('"[],')):
+                    if path.is_dir():
+                        items = [item for item in path.rglob("*") if item.is_file()]
+                    else:
+                        items = [path]
+                    for item in items:
+                        files[item.relative_to(context).as_posix()] = item
+
+    for context in contexts:
+        if (dockerfile_file := context.joinpath(dockerfile_name)).is_file():
+            files[dockerfile_name] = dockerfile_file
+            break
+    else:
+        LOG.error(f"Unable to find {dockerfile_name} in any of {contexts}")
         sys.exit(1)
 
-    if environment:
-        versioned_tag = constants.CONTEXT[tool][environment]["versioned_tag"]
-        latest_tag = constants.CONTEXT[tool][environment]["latest_tag"]
-        buildargs = copy.deepcopy(
-            constants.CONTEXT[tool][environment]["buildargs_base"]
-        )
+    return dict(sorted(files.items()))
+
+
+def get_context_digest(*, files: dict[str, Path]) -> str:
+    """Return a digest of the paths, permissions, and contents of the provided context files"""
+    digest = hashlib.sha256()
+    for name, file in sorted(files.items()):
+        digest.update(name.encode("UTF-8"))
+        digest.update(oct(file.stat().st_mode & 0o777).encode("UTF-8"))
+        digest.update(file.read_bytes())
+
+    return digest.hexdigest()
+
+
+def create_build_context(*, files: dict[str, Path]) -> tuple[Path, str]:
+    """Return a tarball of only the provided build context files, along with its digest"""
+    context_digest: str = get_context_digest(files=files)
+    tarball: Path = constants.CONTEXTS.joinpath(f"{context_digest}.tar")
+    if tarball.is_file():
+        LOG.debug(f"Reusing the cached build context {tarball}")
+        # The modification time tracks the last use, for gc
+        tarball.touch()
+        return tarball, context_digest
+
+    constants.CONTEXTS.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        dir=constants.CONTEXTS, suffix=".tar.tmp", delete=False
+    ) as temporary_file:
+        with tarfile.open(fileobj=temporary_file, mode="w") as tar:
+            for name, file in sorted(files.items()):
+                tarinfo = tar.gettarinfo(str(file), arcname=name)
+                # Normalized so that the same files always produce the same tarball
+                tarinfo.mtime = 0
+                tarinfo.uid = tarinfo.gid = 0
+                tarinfo.uname = tarinfo.gname = ""
+                with open(file, "rb") as file_object:
+                    tar.addfile(tarinfo, file_object)
+
+    # Atomic, so concurrent builds of the same context never see a partial tarball
+    os.replace(temporary_file.name, tarball)
+    LOG.debug(f"Created the build context {tarball} with {len(files)} files")
+    return tarball, context_digest
+
+
+def build_image_from_context(
+    *, build_kwargs: dict, files: dict[str, Path]
+) -> docker.models.images.Image:
+    """Build an image from a minimal tarball of the provided build context files"""
+    tarball, _ = create_build_context(files=files)
+    with open(tarball, "rb") as fileobj:
+        build_kwargs = {**build_kwargs, "fileobj": fileobj, "custom_context": True}
+        log_image_build(build_kwargs=build_kwargs)
+        return build_image(build_kwargs=build_kwargs)
 
-        # Needed for the base of Dockerfiles for {tool}-{environment} combos
-        easy_infra_tag_tool_only = constants.CONTEXT[tool]["versioned_tag"]
-        buildargs["EASY_INFRA_TAG_TOOL_ONLY"] = easy_infra_tag_tool_only
-    else:
-        versioned_tag = constants.CONTEXT[tool]["versioned_tag"]
-        latest_tag = constants.CONTEXT[tool]["latest_tag"]
-        buildargs = copy.deepcopy(constants.CONTEXT[tool]["buildargs_base"])
 
-    # Layers the setup_buildargs on top of the base buildargs from the CONTEXT
-    buildargs.update(setup_buildargs(tool=tool, environment=environment, trace=trace))
+def get_build_digest(*, buildargs: dict, files: dict[str, Path]) -> str:
+    """Return a digest of the buildargs, platform, and build context of an image build"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps(buildargs, sort_keys=True).encode("UTF-8"))
+    digest.update(PLATFORM.encode("UTF-8"))
+    digest.update(get_context_digest(files=files).encode("UTF-8"))
 
-    image_and_versioned_tag: str = f"{constants.IMAGE}:{versioned_tag}"
-    tool_image_and_latest_tag_no_hash: str = f"{constants.IMAGE}:latest-{tool}"
-    # Default; will be updated later if there are tool-env Dockerfile/frags
-    tool_env_exists = False
+    return digest.hexdigest()
 
-    LOG.debug(
-        f"Running build_and_tag for {image_and_versioned_tag} and {trace=} using {versioned_tag=}, {latest_tag=}, {buildargs=}"
+
+def get_artifact_packages() -> list[str]:
+    """Return the packages which are prebuilt into their own seiso/easy_infra_artifact image"""
+    return sorted(
+        package
+        for package in constants.COMPILED_CONFIG.helpers.get("all", ())
+        if constants.BUILD.joinpath(f"Dockerfile.{package}").is_file()
     )
 
-    # Build the config for rendering Dockerfile.j2
-    config = {}
-    config["versioned_tag"] = versioned_tag
-    config["dockerfile_base"] = constants.BUILD.joinpath("Dockerfile.base").read_text(
+
+def get_commit_arg(*, package: str) -> str | None:
+    """Return the buildarg which pins the provided package to a commit, if its Dockerfile has one"""
+    dockerfile: Path = constants.BUILD.joinpath(f"Dockerfile.{package}")
+    commit_arg: str = package.upper().replace("-", "_") + "_COMMIT"
+    if dockerfile.is_file() and re.search(
+        rf"^ARG {commit_arg}\b", dockerfile.read_text(encoding="UTF-8"), re.MULTILINE
+    ):
+        return commit_arg
+
+    return None
+
+
+def get_artifact_build(
+    *,
+    package: str,
+    base_image_and_tag: str | None = None,
+    reproducible: bool = False,
+) -> tuple[dict, dict[str, Path]]:
+    """Return the build kwargs and context files of the artifact image of the provided package"""
+    buildargs: dict = {}
+    add_platform_to_buildargs(buildargs=buildargs)
+    add_version_to_buildarg(buildargs=buildargs, thing=package)
+    dockerfile_name: str = f"Dockerfile.{package}"
+    dockerfile: str = constants.BUILD.joinpath(dockerfile_name).read_text(
         encoding="UTF-8"
     )
-    config["arguments"] = []
-
-    LOG.debug(
-        f"Rendering {constants.DOCKERFILE_INPUT_FILE} to build seiso/easy_infra_base for {tool=} and {environment=}"
+    version: str = constants.CONFIG["packages"][package]["version"]
+    # Packages which are built from source are pinned to the commit that their version pointed to when it was recorded by task update
+    if reproducible and (commit_arg := get_commit_arg(package=package)):
+        if not (commit := constants.CONFIG["packages"][package].get("commit")):
+            LOG.error(
+                f"{package} {version} does not have a commit in {__project_name__}.yml; run task update to record it"
+            )
+            sys.exit(1)
+        buildargs[commit_arg] = commit
+    tag: str = f"{package}-{version}-{buildargs['BUILDARCH']}"
+    if re.search(r"^ARG EASY_INFRA_TAG$", dockerfile, re.MULTILINE):
+        if not base_image_and_tag:
+            LOG.error(f"{dockerfile_name} is built FROM {constants.BASE_IMAGE}")
+            sys.exit(1)
+        buildargs["EASY_INFRA_TAG"] = base_image_and_tag.rsplit(":", 1)[-1]
+        # Each base gets its own artifact, rather than overwriting the artifact of another base
+        tag = f"{tag}-{buildargs['EASY_INFRA_TAG']}"
+
+    files: dict[str, Path] = get_context_files(
+        dockerfile=dockerfile,
+        dockerfile_name=dockerfile_name,
+        contexts=[constants.BUILD],
     )
-    render_jinja2(
-        template_file=constants.DOCKERFILE_INPUT_FILE,
-        config=config,
-        output_file=constants.DOCKERFILE_OUTPUT_FILE,
+    digest: str = get_build_digest(buildargs=buildargs, files=files)
+    build_kwargs = {
+        "buildargs": buildargs,
+        "dockerfile": dockerfile_name,
+        "platform": PLATFORM,
+        "rm": True,
+        "tag": f"{constants.ARTIFACT_IMAGE}:{tag}",
+        "target": package,
+        "labels": {constants.BUILD_DIGEST_LABEL: digest},
+    }
+
+    return build_kwargs, files
+
+
+def build_artifact(*, build_kwargs: dict, files: dict[str, Path]) -> str:
+    """Build the provided seiso/easy_infra_artifact image and return its image and tag"""
+    artifact_image_and_tag: str = build_kwargs["tag"]
+    digest: str = build_kwargs["labels"][constants.BUILD_DIGEST_LABEL]
+
+    # Memoized, so concurrent builds which need the same artifact only build it once, without waiting on other artifacts
+    with ENGINE_LOCK:
+        lock: threading.Lock = ARTIFACT_LOCKS.setdefault(
+            (get_engine(), digest), threading.Lock()
+        )
+    with lock:
+        if (get_engine(), digest) in ARTIFACT_IMAGES:
+            return ARTIFACT_IMAGES[(get_engine(), digest)]
+
+        try:
+            image = get_client().images.get(artifact_image_and_tag)
+            if image.labels.get(constants.BUILD_DIGEST_LABEL) == digest:
+                LOG.info(
+                    f"Reusing {artifact_image_and_tag} because its inputs have not changed"
+                )
+                record_image_use(image_and_tag=artifact_image_and_tag)
+                ARTIFACT_IMAGES[(get_engine(), digest)] = artifact_image_and_tag
+                return artifact_image_and_tag
+            LOG.info(
+                f"Rebuilding {artifact_image_and_tag} because its inputs have changed"
+            )
+        except docker.errors.ImageNotFound:
+            pass
+
+        try:
+            build_image_from_context(build_kwargs=build_kwargs, files=files)
+        except docker.errors.BuildError as build_err:
+            LOG.exception(
+                f"Failed to build {artifact_image_and_tag} platform {PLATFORM}...",
+            )
+            log_build_log(build_err=build_err)
+            sys.exit(1)
+
+        record_image_use(image_and_tag=artifact_image_and_tag)
+        ARTIFACT_IMAGES[(get_engine(), digest)] = artifact_image_and_tag
+
+    return artifact_image_and_tag
+
+
+def get_security_tool_stage(*, security_tool: str, artifact_image_and_tag: str) -> str:
+    """Return a stage which stands in for Dockerfile.{security_tool} using its artifact image"""
+    return f"FROM {artifact_image_and_tag} AS {security_tool}"
+
+
+def get_base_build(
+    *, trace: bool = False, reproducible: bool = False
+) -> tuple[dict, dict[str, Path]]:
+    """Return the build kwargs and the build context files for seiso/easy_infra_base"""
+    buildargs: dict = setup_base_buildargs(trace=trace)
+    files: dict[str, Path] = get_context_files(
+        dockerfile=constants.BUILD.joinpath("Dockerfile.base").read_text(
+            encoding="UTF-8"
+        ),
+        dockerfile_name="Dockerfile.base",
+        contexts=[constants.BUILD],
     )
 
-    base_image_and_versioned_tag = f"seiso/easy_infra_base:{versioned_tag}"
+    # The artifact tags only change with the version, so the digest uses the artifact build digests instead
+    digest_buildargs: dict = copy.deepcopy(buildargs)
+    for package in get_artifact_packages():
+        artifact_build_kwargs, _ = get_artifact_build(
+            package=package, reproducible=reproducible
+        )
+        arg: str = package.upper().replace("-", "_") + "_ARTIFACT"
+        buildargs[arg] = artifact_build_kwargs["tag"]
+        digest_buildargs[arg] = artifact_build_kwargs["labels"][
+            constants.BUILD_DIGEST_LABEL
+        ]
 
-    # Purposefully has no caching
+    digest: str = get_build_digest(buildargs=digest_buildargs, files=files)
     build_kwargs = {
         "buildargs": buildargs,
-        "dockerfile": "Dockerfile",
-        "path": str(constants.BUILD),
+        "dockerfile": "Dockerfile.base",
         "platform": PLATFORM,
         "rm": True,
-        "tag": base_image_and_versioned_tag,
-        "target": "final",
+        "tag": f"{constants.BASE_IMAGE}:{digest[:16]}",
+        "target": "base",
+        "labels": {constants.BUILD_DIGEST_LABEL: digest},
     }
-    log_image_build(build_kwargs=build_kwargs)
-    LOG.debug(
-        f"Building {base_image_and_versioned_tag} because it's probably referenced later as a FROM image"
+
+    return build_kwargs, files
+
+
+def build_base(*, trace: bool = False) -> str:
+    """Build seiso/easy_infra_base once per set of inputs and return its image and tag"""
+    build_kwargs, files = get_base_build(trace=trace)
+    digest: str = build_kwargs["labels"][constants.BUILD_DIGEST_LABEL]
+    base_image_and_tag: str = build_kwargs["tag"]
+
+    # The tag is derived from the build digest, so an existing image was built from the same inputs
+    with get_engine_lock(locks=BASE_LOCKS):
+        if (get_engine(), digest) in BASE_IMAGES:
+            return BASE_IMAGES[(get_engine(), digest)]
+
+        try:
+            get_client().images.get(base_image_and_tag)
+            LOG.info(
+                f"Reusing {base_image_and_tag} because its inputs have not changed"
+            )
+        except docker.errors.ImageNotFound:
+            for package in get_artifact_packages():
+                artifact_build_kwargs, artifact_files = get_artifact_build(
+                    package=package
+                )
+                build_artifact(build_kwargs=artifact_build_kwargs, files=artifact_files)
+
+            try:
+                build_image_from_context(build_kwargs=build_kwargs, files=files)
+            except docker.errors.BuildError as build_err:
+                LOG.exception(
+                    f"Failed to build {base_image_and_tag} platform {PLATFORM}...",
+                )
+                log_build_log(build_err=build_err)
+                sys.exit(1)
+
+        record_image_use(image_and_tag=base_image_and_tag)
+        BASE_IMAGES[(get_engine(), digest)] = base_image_and_tag
+
+    return base_image_and_tag
+
+
+def get_cached_image(*, digest: str) -> docker.models.images.Image | None:
+    """Return a local image that was built from the provided build digest, if one exists"""
+    images: list[docker.models.images.Image] = get_client().images.list(
+        filters={"label": f"{constants.BUILD_DIGEST_LABEL}={digest}"}
     )
-    CLIENT.images.build(**build_kwargs)
+    if not images:
+        return None
 
-    # Required Dockerfile/frag combos
-    custom_tool_name: bool = False  # Default to be updated later
-    for package in constants.CONFIG["packages"]:
-        # If the provided tool matches the package name, use the tool name to find the dockerfile/frag
-        if package == tool:
-            dockerfile_tool: str = f"Dockerfile.{tool}"
-            dockerfrag_tool: str = f"Dockerfrag.{tool}"
-            break
+    return images[0]
 
-        # If the provided tool is a custom name for a tool, use the package name to find the dockerfile/frag
-        if (
-            "tool" in constants.CONFIG["packages"][package]
-            and "name" in constants.CONFIG["packages"][package]["tool"]
-        ):
-            if tool == constants.CONFIG["packages"][package]["tool"]["name"]:
-                custom_tool_name = True
-                dockerfile_tool: str = f"Dockerfile.{package}"
-                dockerfrag_tool: str = f"Dockerfrag.{package}"
-                break
+
+def restamp_image(
+    *, image: docker.models.images.Image, buildargs: dict, image_and_tag: str
+) -> docker.models.images.Image:
+    """Tag a cached image, applying the commit specific metadata from the buildargs if needed"""
+    repository, tag = image_and_tag.split(":")
+    image.tag(repository, tag=tag, force=True)
+
+    environment: list[str] = image.attrs["Config"].get("Env") or []
+    if (
+        image.labels.get("org.opencontainers.image.revision")
+        == buildargs["COMMIT_HASH"]
+        and f"EASY_INFRA_TAG={buildargs['EASY_INFRA_TAG']}" in environment
+    ):
+        return image
+
+    LOG.info(
+        f"Applying the commit specific metadata for {image_and_tag} to {image.short_id}..."
+    )
+    restamp_buildargs: dict = {
+        arg: value
+        for arg, value in buildargs.items()
+        if arg in constants.VOLATILE_BUILDARGS
+    }
+    restamp_buildargs["CACHED_IMAGE"] = image_and_tag
+    dockerfile: str = constants.BUILD.joinpath("Dockerfile.restamp").read_text(
+        encoding="UTF-8"
+    )
+    build_kwargs = {
+        "buildargs": restamp_buildargs,
+        "fileobj": io.BytesIO(dockerfile.encode("UTF-8")),
+        "platform": PLATFORM,
+        "rm": True,
+        "tag": image_and_tag,
+    }
+    return build_image(build_kwargs=build_kwargs)
+
+
+def get_dockerfile_instructions(
+    *, dockerfile: str, stage: str | None = None
+) -> list[str]:
+    """Return the instructions of the provided Dockerfile, optionally of a single stage"""
+    instructions: list[str] = []
+    current: str = ""
+    for line in dockerfile.splitlines():
+        stripped: str = line.strip()
+        if not stripped or stripped.startswith("#"):
+            continue
+        current = f"{current} {stripped}" if current else stripped
+        if current.endswith("\\"):
+            current = current.removesuffix("\\").rstrip()
+            continue
+        instructions.append(current)
+        current = ""
+    if current:
+        instructions.append(current)
+
+    if stage is None:
+        return instructions
+
+    stage_instructions: list[str] = []
+    in_stage: bool = False
+    for instruction in instructions:
+        words: list[str] = instruction.split()
+        if words[0].upper() == "FROM":
+            in_stage = (
+                len(words) >= 4 and words[-2].upper() == "AS" and words[-1] == stage
+            )
+            continue
+        if in_stage:
+            stage_instructions.append(instruction)
+
+    return stage_instructions
+
+
+def get_instruction_fragment(*, instruction: str, base: bool = False) -> str | None:
+    """Return the artifact that the provided instruction copies from, if any"""
+    if match := re.match(r"^COPY\s+.*--from=(\S+)", instruction, flags=re.IGNORECASE):
+        return match.group(1)
+
+    return "base" if base else None
+
+
+def attribute_layers(
+    *,
+    image: docker.models.images.Image,
+    base_image_and_tag: str,
+    dockerfile: str,
+    fragments: list[tuple[str, str]],
+) -> list[dict]:
+    """Attribute each layer in the history of the provided image to the fragment that created it"""
+    # The history is newest first, and layers which are not in the local cache have an Id of <missing>
+    history: list[dict] = list(reversed(get_client().api.history(image.id)))
+    base: docker.models.images.Image = get_client().images.get(base_image_and_tag)
+    base_history: list[dict] = list(reversed(get_client().api.history(base.id)))
+
+    # The base's history is inherited verbatim, but only if the image was built from the base that the tag currently points to
+    # (a cache hit may predate it), which is only certain if the image starts with all of the base's layers
+    base_layer_ids: list[str] = base.attrs["RootFS"]["Layers"]
+    if image.attrs["RootFS"]["Layers"][: len(base_layer_ids)] == base_layer_ids:
+        base_layers: int = len(base_history)
     else:
-        LOG.error(f"Unable to identify the tool {tool} in the config")
+        LOG.warning(
+            f"{image.short_id} was not built from the current {base_image_and_tag}, so its base layers are attributed by their history"
+        )
+        base_layers = 0
+        for layer, base_layer in zip(history, base_history):
+            if (layer["Created"], layer["CreatedBy"]) != (
+                base_layer["Created"],
+                base_layer["CreatedBy"],
+            ):
+                break
+            base_layers += 1
+
+    labels: list[str] = []
+    base_instructions: list[str] = get_dockerfile_instructions(
+        dockerfile=constants.BUILD.joinpath("Dockerfile.base").read_text(
+            encoding="UTF-8"
+        ),
+        stage="base",
+    )
+    parent_layers: int = max(base_layers - len(base_instructions), 0)
+    labels.extend(["parent"] * parent_layers)
+    for instruction in base_instructions[
+        len(base_instructions) - (base_layers - parent_layers) :
+    ]:
+        labels.append(get_instruction_fragment(instruction=instruction, base=True))
+
+    # Match the final stage instructions, in order, against the instructions of each fragment
+    fragment_instructions: list[tuple[str, list[str]]] = [
+        (name, get_dockerfile_instructions(dockerfile=text)) for name, text in fragments
+    ]
+    for instruction in get_dockerfile_instructions(
+        dockerfile=dockerfile, stage="final"
+    ):
+        label: str = "easy_infra"
+        for name, instructions in fragment_instructions:
+            if instructions and instructions[0] == instruction:
+                instructions.pop(0)
+                label = get_instruction_fragment(instruction=instruction) or name
+                break
+        labels.append(label)
+
+    layers: list[dict] = []
+    for index, layer in enumerate(history):
+        layers.append(
+            {
+                "id": layer["Id"],
+                "created_by": layer["CreatedBy"],
+                "size": layer["Size"],
+                # Anything after the rendered instructions was added when the image was restamped
+                "fragment": labels[index] if index < len(labels) else "metadata",
+            }
+        )
+
+    return layers
+
+
+def get_budget(*, tool: str, environment: str | None = None) -> dict:
+    """Return the size budget for the provided tool and environment"""
+    budgets: dict = constants.CONFIG.get("budgets", {})
+    budget: dict = dict(budgets.get("default", {}))
+    budget.update(budgets.get(tool, {}))
+    if environment and environment in constants.ENVIRONMENTS:
+        budget.update(budgets.get(f"{tool}-{environment}", {}))
+
+    return budget
+
+
+def analyze_image(
+    *,
+    image: docker.models.images.Image,
+    image_and_tag: str,
+    tool: str,
+    environment: str | None = None,
+    base_image_and_tag: str,
+    dockerfile: str,
+    fragments: list[tuple[str, str]],
+) -> Path:
+    """Write a size report of the provided image, and exit if it exceeds its budget"""
+    layers: list[dict] = attribute_layers(
+        image=image,
+        base_image_and_tag=base_image_and_tag,
+        dockerfile=dockerfile,
+        fragments=fragments,
+    )
+    fragment_sizes: dict[str, int] = {}
+    for layer in layers:
+        fragment_sizes[layer["fragment"]] = (
+            fragment_sizes.get(layer["fragment"], 0) + layer["size"]
+        )
+
+    size: int = image.attrs["Size"]
+    layer_count: int = len(image.attrs["RootFS"]["Layers"])
+    budget: dict = get_budget(tool=tool, environment=environment)
+    report: dict = {
+        "image": image_and_tag,
+        "platform": PLATFORM,
+        "size": size,
+        "layers": layer_count,
+        "budget": budget,
+        "fragments": dict(
+            sorted(fragment_sizes.items(), key=lambda item: item[1], reverse=True)
+        ),
+        "history": layers,
+    }
+    constants.REPORTS.mkdir(parents=True, exist_ok=True)
+    report_file: Path = constants.REPORTS.joinpath(
+        f"size.{image_and_tag.rsplit(':', 1)[-1]}.json"
+    )
+    report_file.write_text(json.dumps(report, indent=2) + "\n", encoding="UTF-8")
+
+    summary: str = ", ".join(
+        f"{fragment} {fragment_size / 1_000_000:.1f}MB"
+        for fragment, fragment_size in report["fragments"].items()
+    )
+    LOG.info(
+        f"{image_and_tag} is {size / 1_000_000:.1f}MB in {layer_count} layers ({summary}); see {report_file} for details"
+    )
+
+    exceeded: list[str] = []
+    if "max_size_mb" in budget and size > budget["max_size_mb"] * 1_000_000:
+        exceeded.append(
+            f"{size / 1_000_000:.1f}MB is over the budget of {budget['max_size_mb']}MB"
+        )
+    if "max_layers" in budget and layer_count > budget["max_layers"]:
+        exceeded.append(
+            f"{layer_count} layers is over the budget of {budget['max_layers']} layers"
+        )
+    if exceeded:
+        LOG.error(f"{image_and_tag} exceeded its budget; {'; '.join(exceeded)}")
+        # Remove the image so that neither its tags nor its build digest label let a later step or run use it
+        try:
+            get_client().images.remove(image=image.id, force=True)
+        except docker.errors.APIError as error:
+            LOG.warning(f"Unable to remove {image_and_tag}: {error}")
+        sys.exit(1)
+
+    return report_file
+
+
+def get_build_config(
+    *, tool: str, environment: str | None = None, trace: bool = False
+) -> dict:
+    """Return everything needed to build the provided image"""
+    # Input validation
+    if tool not in constants.TOOLS:
+        LOG.error(f"Provided an invalid tool of {tool}")
+        sys.exit(1)
+
+    if environment and environment not in constants.ENVIRONMENTS:
+        LOG.error(f"Provided an invalid environment of {environment}")
         sys.exit(1)
 
+    if environment:
+        versioned_tag = constants.CONTEXT[tool][environment]["versioned_tag"]
+        latest_tag = constants.CONTEXT[tool][environment]["latest_tag"]
+        buildargs = dict(constants.CONTEXT[tool][environment]["buildargs_base"])
+
+        # Needed for the base of Dockerfiles for {tool}-{environment} combos
+        easy_infra_tag_tool_only = constants.CONTEXT[tool]["versioned_tag"]
+        buildargs["EASY_INFRA_TAG_TOOL_ONLY"] = easy_infra_tag_tool_only
+    else:
+        easy_infra_tag_tool_only = None
+        versioned_tag = constants.CONTEXT[tool]["versioned_tag"]
+        latest_tag = constants.CONTEXT[tool]["latest_tag"]
+        buildargs = dict(constants.CONTEXT[tool]["buildargs_base"])
+
+    # Layers the setup_buildargs on top of the base buildargs from the CONTEXT
+    buildargs.update(setup_buildargs(tool=tool, environment=environment, trace=trace))
+
+    # Default; will be updated later if there are tool-env Dockerfile/frags
+    tool_env_exists = False
+
+    # Build the config for rendering Dockerfile.j2
+    config = {}
+    config["versioned_tag"] = versioned_tag
+    config["arguments"] = []
+
+    # Required Dockerfile/frag combos. If the provided tool is a custom name for a tool, use the package name to find the dockerfile/frag
+    package: str = constants.COMPILED_CONFIG.tool_packages[tool]
+    custom_tool_name: bool = package != tool
+    dockerfile_tool: str = f"Dockerfile.{package}"
+    dockerfrag_tool: str = f"Dockerfrag.{package}"
+
     try:
         config["dockerfile_tools"] = [
             constants.BUILD.joinpath(dockerfile_tool).read_text(encoding="UTF-8")
@@ -828,26 +1932,18 @@ def build_and_tag(
         ]
 
         # populate the security tools for {tool}
-        security_tools = []
+        security_tools: list[str] = list(constants.COMPILED_CONFIG.security_tools[tool])
 
-        # Use the package from the earlier loop if the tool name is custom
-        key = package if custom_tool_name else tool
-        if "security" in constants.CONFIG["packages"][key]:
-            for security_tool in constants.CONFIG["packages"][key]["security"]:
-                security_tools.append(security_tool)
-
-        # Load in the security tool dockerfiles/frags
+        # Load in the security tool frags. Their dockerfiles are built once into their own images, which are referenced via
+        # dockerfile_security_tools by the caller (see get_security_tool_stage)
         config["dockerfile_security_tools"] = []
         config["dockerfrag_security_tools"] = []
         for security_tool in security_tools:
             LOG.debug(
                 f"Found security tool {security_tool} for {tool}, adding the related dockerfile/frag combo to the config..."
             )
-            config["dockerfile_security_tools"].append(
-                constants.BUILD.joinpath(f"Dockerfile.{security_tool}").read_text(
-                    encoding="UTF-8"
-                )
-            )
+            if not constants.BUILD.joinpath(f"Dockerfile.{security_tool}").is_file():
+                raise FileNotFoundError(f"Dockerfile.{security_tool}")
             config["dockerfrag_security_tools"].append(
                 constants.BUILD.joinpath(f"Dockerfrag.{security_tool}").read_text(
                     encoding="UTF-8"
@@ -867,22 +1963,23 @@ def build_and_tag(
         config["dockerfrag_envs"] = []
         config["dockerfile_tool_envs"] = []
         config["dockerfrag_tool_envs"] = []
+        tool_envs: list[str] = []
 
-        for package in constants.CONFIG["environments"][environment]["packages"]:
+        for env_package in constants.COMPILED_CONFIG.environment_packages[environment]:
             try:
                 config["dockerfile_envs"].append(
-                    constants.BUILD.joinpath(f"Dockerfile.{package}").read_text(
+                    constants.BUILD.joinpath(f"Dockerfile.{env_package}").read_text(
                         encoding="UTF-8"
                     )
                 )
                 config["dockerfrag_envs"].append(
-                    constants.BUILD.joinpath(f"Dockerfrag.{package}").read_text(
+                    constants.BUILD.joinpath(f"Dockerfrag.{env_package}").read_text(
                         encoding="UTF-8"
                     )
                 )
             except FileNotFoundError:
                 LOG.exception(
-                    f"An environment of {environment} was specified, but at least one of the required files for {package} was not found"
+                    f"An environment of {environment} was specified, but at least one of the required files for {env_package} was not found"
                 )
                 sys.exit(1)
 
@@ -906,6 +2003,7 @@ def build_and_tag(
                                 f"Dockerfrag.{key}-{environment}"
                             ).read_text(encoding="UTF-8")
                         )
+                        tool_envs.append(f"{key}-{environment}")
                     except FileNotFoundError:
                         LOG.exception(
                             f"Dockerfile.{key}-{environment} existed but the related (required) Dockerfrag was not found"
@@ -920,71 +2018,1268 @@ def build_and_tag(
             "The environment was not set (or not set properly); not requiring the related Dockerfile/frag"
         )
 
+    # The name and contents of each Dockerfrag, in the order that they are rendered into the final stage
+    fragment_names: list[str] = [dockerfrag_tool.removeprefix("Dockerfrag.")]
+    fragment_names.extend(security_tools)
+    fragment_texts: list[str] = (
+        config["dockerfrag_tools"] + config["dockerfrag_security_tools"]
+    )
+    if environment in constants.ENVIRONMENTS:
+        fragment_names.extend(
+            constants.COMPILED_CONFIG.environment_packages[environment]
+        )
+        fragment_names.extend(tool_envs)
+        fragment_texts.extend(
+            config["dockerfrag_envs"] + config["dockerfrag_tool_envs"]
+        )
+
+    return {
+        "versioned_tag": versioned_tag,
+        "latest_tag": latest_tag,
+        "buildargs": buildargs,
+        "config": config,
+        "tool_env_exists": tool_env_exists,
+        "security_tools": security_tools,
+        "fragments": list(zip(fragment_names, fragment_texts)),
+        "dockerfile_tool": dockerfile_tool,
+        # The stage in dockerfile_tool, which {tool}-{environment} specific Dockerfiles are built FROM
+        "tool_target": package,
+        "easy_infra_tag_tool_only": easy_infra_tag_tool_only,
+    }
+
+
+def get_filesystem_digest(*, image: docker.models.images.Image) -> str:
+    """Return the chain ID of the top layer of the provided image"""
+    # This only changes when the filesystem does, i.e. not when the image is restamped
+    return get_chain_ids(diff_ids=image.attrs["RootFS"]["Layers"])[-1]
+
+
+def generate_sbom(*, image: docker.models.images.Image, image_and_tag: str) -> Path:
+    """Return the SBOM of the provided image, reusing any SBOM of the same filesystem"""
+    sbom_file: Path = constants.SBOMS.joinpath(
+        f"{get_filesystem_digest(image=image).removeprefix('sha256:')}.json"
+    )
+    # syft reads the image from the engine that it was built on
+    engine: str = get_engine()
+    with SBOM_LOCK:
+        lock: threading.Lock = SBOM_LOCKS.setdefault(sbom_file.name, threading.Lock())
+
+    with lock:
+        if sbom_file.is_file() and sbom_file.stat().st_size > 0:
+            LOG.debug(f"Reusing {sbom_file} for {image_and_tag}")
+            # Keeps the least recently used SBOMs first in line for gc
+            sbom_file.touch()
+            return sbom_file
+
+        constants.SBOMS.mkdir(parents=True, exist_ok=True)
+        partial_file: Path = sbom_file.with_suffix(".partial")
+        LOG.info(f"Generating the SBOM for {image_and_tag}...")
+        try:
+            subprocess.run(
+                [
+                    "syft",
+                    f"docker:{image_and_tag}",
+                    "-o",
+                    "json",
+                    "--file",
+                    str(partial_file),
+                ],
+                capture_output=True,
+                check=True,
+                env={**os.environ, "DOCKER_HOST": engine} if engine else None,
+            )
+        except subprocess.CalledProcessError as error:
+            LOG.error(
+                f"stdout: {error.stdout.decode('UTF-8')}, stderr: {error.stderr.decode('UTF-8')}"
+            )
+            sys.exit(1)
+        partial_file.replace(sbom_file)
+
+    return sbom_file
+
+
+def describe_image_source(
+    *, source: dict, image: docker.models.images.Image, image_and_tag: str
+) -> None:
+    """Update the provided syft or grype image source to describe the provided image"""
+    if source.get("imageID") != image.id:
+        # Only the filesystem is shared with the scanned image, so its manifest and config don't apply
+        for key in ("manifestDigest", "manifest", "config"):
+            source.pop(key, None)
+    source.update(
+        {
+            "userInput": image_and_tag,
+            "imageID": image.id,
+            "tags": image.tags,
+            "repoDigests": image.attrs.get("RepoDigests") or [],
+        }
+    )
+
+
+def get_vulnerability_db_version() -> str:
+    """Update the grype vulnerability database once per run, and return its version"""
+    with VULNERABILITY_DB_LOCK:
+        if "version" in VULNERABILITY_DB:
+            return VULNERABILITY_DB["version"]
+
+        try:
+            LOG.info("Updating the grype vulnerability database...")
+            subprocess.run(["grype", "db", "update"], capture_output=True, check=True)
+            status: dict = json.loads(
+                subprocess.run(
+                    ["grype", "db", "status", "--output", "json"],
+                    capture_output=True,
+                    check=True,
+                ).stdout
+            )
+        except subprocess.CalledProcessError as error:
+            LOG.error(
+                f"stdout: {error.stdout.decode('UTF-8')}, stderr: {error.stderr.decode('UTF-8')}"
+            )
+            sys.exit(1)
+
+        VULNERABILITY_DB["version"] = hashlib.sha256(
+            f"{status.get('schemaVersion')} {status.get('built')}".encode("UTF-8")
+        ).hexdigest()[:16]
+
+    return VULNERABILITY_DB["version"]
+
+
+def scan_vulnerabilities(
+    *, image: docker.models.images.Image, image_and_tag: str, db_version: str
+) -> Path:
+    """Return the vulnerability scan of the provided image, reusing any scan with the same database"""
+    sbom_file: Path = generate_sbom(image=image, image_and_tag=image_and_tag)
+    vulns_file: Path = constants.VULNS.joinpath(f"{sbom_file.stem}-{db_version}.json")
+    if vulns_file.is_file() and vulns_file.stat().st_size > 0:
+        LOG.debug(f"Reusing {vulns_file} for {image_and_tag}")
+        vulns_file.touch()
+        return vulns_file
+
+    constants.VULNS.mkdir(parents=True, exist_ok=True)
+    partial_file: Path = vulns_file.with_suffix(".partial")
+    LOG.info(f"Running a vulnerability scan on the SBOM of {image_and_tag}...")
+    try:
+        subprocess.run(
+            [
+                "grype",
+                f"sbom:{sbom_file}",
+                "--output",
+                "json",
+                "--file",
+                str(partial_file),
+            ],
+            capture_output=True,
+            check=True,
+            # The database was already updated by get_vulnerability_db_version
+            env={**os.environ, "GRYPE_DB_AUTO_UPDATE": "false"},
+        )
+    except subprocess.CalledProcessError as error:
+        LOG.error(
+            f"stdout: {error.stdout.decode('UTF-8')}, stderr: {error.stderr.decode('UTF-8')}"
+        )
+        sys.exit(1)
+    partial_file.replace(vulns_file)
+
+    return vulns_file
+
+
+def group_tags_by_image(*, tags: list[str]) -> dict[str, list[str]]:
+    """Group the provided tags by the filesystem digest of the easy_infra image that they point to"""
+    images: dict[str, list[str]] = {}
+    for tag in tags:
+        image_and_tag: str = f"{constants.IMAGE}:{tag}"
+        try:
+            image: docker.models.images.Image = get_client().images.get(image_and_tag)
+        except docker.errors.ImageNotFound:
+            LOG.error(f"Unable to find {image_and_tag}; has it been built?")
+            sys.exit(1)
+        images.setdefault(get_filesystem_digest(image=image), []).append(tag)
+
+    return images
+
+
+def run_scans(
+    *, function, kwargs: dict, images: dict[str, list[str]], jobs: int
+) -> None:
+    """Run the provided function for each tag, scanning up to jobs images concurrently"""
+    if jobs < 1:
+        LOG.error(f"jobs must be at least 1, not {jobs}")
+        sys.exit(1)
+
+    def scan(*, tags: list[str]) -> None:
+        # Only the first tag is scanned, and the others reuse its results
+        for tag in tags:
+            function(tag=tag, **kwargs)
+
+    failed: dict[str, BaseException] = {}
+    with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="scan") as executor:
+        futures: dict = {
+            executor.submit(scan, tags=tags): tags[0] for tags in images.values()
+        }
+        for future, tag in futures.items():
+            if (exception := future.exception()) is not None:
+                LOG.error(f"Failed to scan {constants.IMAGE}:{tag}: {exception!r}")
+                failed[tag] = exception
+
+    if failed:
+        LOG.error(f"The scans of {sorted(failed)} failed")
+        sys.exit(1)
+
+
+def build_and_tag(
+    *, tool: str, environment: str | None = None, trace: bool = False
+) -> None:
+    """Build the provided image and tag it with the provided list of tags"""
+    start: float = time.monotonic()
+    build_config: dict = get_build_config(
+        tool=tool, environment=environment, trace=trace
+    )
+    versioned_tag: str = build_config["versioned_tag"]
+    latest_tag: str = build_config["latest_tag"]
+    buildargs: dict = build_config["buildargs"]
+    config: dict = build_config["config"]
+    tool_env_exists: bool = build_config["tool_env_exists"]
+    image_and_versioned_tag: str = f"{constants.IMAGE}:{versioned_tag}"
+    tool_image_and_latest_tag_no_hash: str = f"{constants.IMAGE}:latest-{tool}"
+
+    LOG.debug(
+        f"Running build_and_tag for {image_and_versioned_tag} and {trace=} using {versioned_tag=}, {latest_tag=}, {buildargs=}"
+    )
+
+    # The base is shared by all of the images, but it is referenced by EASY_INFRA_TAG in the FROM of the tool Dockerfiles
+    base_image_and_tag: str = build_base(trace=trace)
     LOG.debug(
-        f"Rendering {constants.DOCKERFILE_INPUT_FILE} to build seiso/easy_infra for {tool=} and {environment=}"
+        f"Tagging {base_image_and_tag} as {constants.BASE_IMAGE}:{versioned_tag}..."
+    )
+    get_client().images.get(base_image_and_tag).tag(
+        constants.BASE_IMAGE, tag=versioned_tag, force=True
     )
+
+    # The security tool stages are built once per version and shared by every image which uses them
+    artifact_digests: dict[str, str] = {}
+    for security_tool in build_config["security_tools"]:
+        artifact_build_kwargs, artifact_files = get_artifact_build(
+            package=security_tool, base_image_and_tag=base_image_and_tag
+        )
+        artifact_image_and_tag: str = build_artifact(
+            build_kwargs=artifact_build_kwargs, files=artifact_files
+        )
+        config["dockerfile_security_tools"].append(
+            get_security_tool_stage(
+                security_tool=security_tool,
+                artifact_image_and_tag=artifact_image_and_tag,
+            )
+        )
+        artifact_digests[security_tool.upper() + "_ARTIFACT"] = artifact_build_kwargs[
+            "labels"
+        ][constants.BUILD_DIGEST_LABEL]
+
+    # Render into a private workspace so that concurrent builds don't collide
+    with build_workspace(name=versioned_tag) as workspace:
+        LOG.debug(
+            f"Rendering {constants.DOCKERFILE_INPUT_FILE} to build seiso/easy_infra for {tool=} and {environment=}"
+        )
+        render_functions(
+            tool=tool,
+            output_file=workspace.joinpath(constants.FUNCTIONS_OUTPUT_FILE.name),
+        )
+        dockerfile_file: Path = workspace.joinpath(
+            constants.DOCKERFILE_OUTPUT_FILE.name
+        )
+        render_jinja2(
+            template_file=constants.DOCKERFILE_INPUT_FILE,
+            config=config,
+            output_file=dockerfile_file,
+        )
+
+        if tool_env_exists:
+            pull_image(image_and_tag=tool_image_and_latest_tag_no_hash)
+            tool_image_and_versioned_tag: str = (
+                f"seiso/easy_infra:{build_config['easy_infra_tag_tool_only']}"
+            )
+            build_kwargs = {
+                "buildargs": buildargs,
+                "cache_from": [tool_image_and_latest_tag_no_hash],
+                "dockerfile": build_config["dockerfile_tool"],
+                "platform": PLATFORM,
+                "rm": True,
+                "tag": tool_image_and_versioned_tag,
+                "target": build_config["tool_target"],
+            }
+            LOG.debug(
+                f"Building {tool_image_and_versioned_tag} because it's probably referenced later as a FROM image"
+            )
+            build_image_from_context(
+                build_kwargs=build_kwargs,
+                files=get_context_files(
+                    dockerfile=constants.BUILD.joinpath(
+                        build_config["dockerfile_tool"]
+                    ).read_text(encoding="UTF-8"),
+                    dockerfile_name=build_config["dockerfile_tool"],
+                    contexts=[constants.BUILD],
+                ),
+            )
+
+        # Only send the files that the Dockerfile uses, preferring the rendered files in the workspace
+        files: dict[str, Path] = get_context_files(
+            dockerfile=dockerfile_file.read_text(encoding="UTF-8"),
+            dockerfile_name=dockerfile_file.name,
+            contexts=[workspace, constants.BUILD],
+        )
+
+        # Skip the build if an image was already built from the same inputs, ignoring the buildargs that only end up in metadata
+        digest_buildargs: dict = {
+            arg: value
+            for arg, value in buildargs.items()
+            if arg not in constants.VOLATILE_BUILDARGS
+        }
+        digest_buildargs["EASY_INFRA_BASE"] = base_image_and_tag
+        digest_buildargs.update(artifact_digests)
+        if tool_env_exists:
+            digest_buildargs["EASY_INFRA_TOOL_ONLY"] = (
+                get_client().images.get(tool_image_and_versioned_tag).id
+            )
+        digest: str = get_build_digest(buildargs=digest_buildargs, files=files)
+        if (cached_image := get_cached_image(digest=digest)) is not None:
+            LOG.info(
+                f"Skipping the build of {image_and_versioned_tag} because {cached_image.short_id} was built from the same inputs"
+            )
+            image = restamp_image(
+                image=cached_image,
+                buildargs=buildargs,
+                image_and_tag=image_and_versioned_tag,
+            )
+        else:
+            try:
+                pull_image(image_and_tag=tool_image_and_latest_tag_no_hash)
+                build_kwargs = {
+                    "buildargs": buildargs,
+                    "cache_from": [tool_image_and_latest_tag_no_hash],
+                    "dockerfile": "Dockerfile",
+                    "platform": PLATFORM,
+                    "rm": True,
+                    "tag": image_and_versioned_tag,
+                    "target": "final",
+                    "labels": {constants.BUILD_DIGEST_LABEL: digest},
+                }
+                LOG.debug(f"Building the usable image {image_and_versioned_tag}")
+                image = build_image_from_context(build_kwargs=build_kwargs, files=files)
+            except docker.errors.BuildError as build_err:
+                LOG.exception(
+                    f"Failed to build {image_and_versioned_tag} platform {PLATFORM}...",
+                )
+                log_build_log(build_err=build_err)
+                sys.exit(1)
+
+        analyze_image(
+            image=image,
+            image_and_tag=image_and_versioned_tag,
+            tool=tool,
+            environment=environment,
+            base_image_and_tag=base_image_and_tag,
+            dockerfile=dockerfile_file.read_text(encoding="UTF-8"),
+            fragments=build_config["fragments"],
+        )
+
+        # Tag latest
+        LOG.info(f"Tagging {constants.IMAGE}:{latest_tag}...")
+        # force=True is necessary because sometimes the latest images already exist locally because they were pulled or built as a part of being the FROM
+        # of another image. force=True ensures the versioned and latest tags are pointing to the exact same container ID.
+        image.tag(constants.IMAGE, tag=latest_tag, force=True)
+        record_image_use(image_and_tag=image_and_versioned_tag)
+
+        # Restamped cache hits and the SBOM don't reflect what the build of this image costs
+        if cached_image is None:
+            record_timing(
+                key=get_timing_key(tool=tool, environment=environment),
+                phase="build",
+                duration=time.monotonic() - start,
+            )
+
+        # Generating the SBOM while the image is fresh means that the sbom and vulnscan steps don't need to read the image again
+        if shutil.which("syft"):
+            generate_sbom(image=image, image_and_tag=image_and_versioned_tag)
+        else:
+            LOG.debug(
+                f"Skipping the SBOM for {image_and_versioned_tag} because syft is not installed"
+            )
+
+
+def get_functions_config(*, tool: str) -> dict:
+    """Return the config used to render the functions that the provided tool cares about"""
+    # Include the helpers of the tool we're working on which have a security config
+    tools: list[str] = [tool] + [
+        package
+        for package in constants.COMPILED_CONFIG.helpers.get(tool, ())
+        if constants.COMPILED_CONFIG.packages[package].security_tools
+    ]
+
+    return filter_config(config=constants.CONFIG, tools=tools)
+
+
+def render_functions(
+    *, tool: str, output_file: Path = constants.FUNCTIONS_OUTPUT_FILE
+) -> None:
+    """Render the functions that the provided tool cares about"""
     render_jinja2(
-        template_file=constants.DOCKERFILE_INPUT_FILE,
-        config=config,
-        output_file=constants.DOCKERFILE_OUTPUT_FILE,
-    )
-
-    if tool_env_exists:
-        pull_image(image_and_tag=tool_image_and_latest_tag_no_hash)
-        tool_image_and_versioned_tag: str = (
-            f"seiso/easy_infra:{easy_infra_tag_tool_only}"
-        )
-        target = package if custom_tool_name else tool
-        build_kwargs = {
-            "buildargs": buildargs,
-            "cache_from": [tool_image_and_latest_tag_no_hash],
-            "dockerfile": dockerfile_tool,
-            "path": str(constants.BUILD),
+        template_file=constants.FUNCTIONS_INPUT_FILE,
+        config=get_functions_config(tool=tool),
+        output_file=output_file,
+        output_mode=0o755,
+    )
+
+
+def plan_build(
+    *,
+    tools_to_environments: dict[str, dict[str, list[str]]],
+    environment: str,
+    trace: bool = False,
+) -> dict[str, dict]:
+    """Plan the images to build as a DAG of node names to their function, kwargs, and dependencies"""
+    plan: dict[str, dict] = {}
+    # Every image is built FROM seiso/easy_infra_base
+    plan["base"] = {
+        "function": build_base,
+        "kwargs": {"trace": trace},
+        "dependencies": set(),
+    }
+
+    # Sorted so that the resulting build order is deterministic
+    for tool in sorted(tools_to_environments):
+        # Build and Tag the tool-only tag only when a single environment isn't provided
+        if environment not in constants.ENVIRONMENTS and tools_to_environments[
+            tool
+        ].get("tool_only", True):
+            plan[tool] = {
+                "function": build_and_tag,
+                "kwargs": {"tool": tool, "environment": None, "trace": trace},
+                "dependencies": {"base"},
+            }
+
+        # {tool}-{environment} images may be built FROM the tool-only image, and they re-tag it, so they must come after it
+        for env in sorted(tools_to_environments[tool]["environments"]):
+            plan[f"{tool}-{env}"] = {
+                "function": build_and_tag,
+                "kwargs": {"tool": tool, "environment": env, "trace": trace},
+                "dependencies": {tool} if tool in plan else {"base"},
+            }
+
+    LOG.debug(f"Returning a build plan of {plan}")
+
+    return plan
+
+
+def get_cache_images(*, plan: dict[str, dict]) -> list[str]:
+    """Return the images that the builds in the provided plan use as a cache"""
+    return sorted(
+        {
+            f"{constants.IMAGE}:latest-{node['kwargs']['tool']}"
+            for node in plan.values()
+            if node["function"] is build_and_tag
+        }
+    )
+
+
+def run_dag(
+    *,
+    plan: dict[str, dict],
+    executor: ThreadPoolExecutor,
+    on_complete: Callable[[str, Future], Future | None],
+) -> set[str]:
+    """Run the provided plan in dependency order, returning the nodes skipped due to a failure"""
+    sorter: TopologicalSorter = TopologicalSorter(
+        {name: node["dependencies"] for name, node in plan.items()}
+    )
+    sorter.prepare()
+
+    failed: set[str] = set()
+    skipped: set[str] = set()
+    # Each future maps to its node name, and whether it runs the node itself or is a follow-up returned by on_complete
+    futures: dict[Future, tuple[str, bool]] = {}
+    while sorter.is_active() or futures:
+        if sorter.is_active():
+            for name in sorted(sorter.get_ready()):
+                node: dict = plan[name]
+                if blocked_by := node["dependencies"].intersection(
+                    skipped.union(failed)
+                ):
+                    LOG.error(f"Skipping {name} because {sorted(blocked_by)} failed")
+                    skipped.add(name)
+                    sorter.done(name)
+                    continue
+
+                LOG.info(f"Scheduling the {name} build...")
+                future = executor.submit(node["function"], **node["kwargs"])
+                futures[future] = (name, True)
+
+        # Skipped nodes may have made other nodes ready without anything being in flight
+        if not futures:
+            continue
+
+        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+        for future in done:
+            name, is_node = futures.pop(future)
+            if is_node:
+                # The functions use sys.exit on failures, which is captured here as a SystemExit
+                if future.exception() is not None:
+                    failed.add(name)
+                sorter.done(name)
+
+            if (follow_up := on_complete(name, future)) is not None:
+                futures[follow_up] = (name, False)
+
+    return skipped
+
+
+def run_build_plan(*, plan: dict[str, dict], jobs: int = 1) -> None:
+    """Build the provided plan using up to jobs concurrent builds"""
+    if jobs < 1:
+        LOG.error(f"jobs must be at least 1, not {jobs}")
+        sys.exit(1)
+
+    failed: dict[str, BaseException] = {}
+
+    def on_complete(name: str, future: Future) -> None:
+        if (exception := future.exception()) is not None:
+            LOG.error(f"Failed to build {name}: {exception!r}")
+            failed[name] = exception
+        else:
+            LOG.info(f"Successfully built {name}")
+
+    with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="build") as executor:
+        skipped: set[str] = run_dag(
+            plan=plan, executor=executor, on_complete=on_complete
+        )
+
+    if failed or skipped:
+        LOG.error(
+            f"The build failed; {sorted(failed)} failed and {sorted(skipped)} were skipped"
+        )
+        sys.exit(1)
+
+
+def get_engine_groups(*, plan: dict[str, dict]) -> list[list[str]]:
+    """Return the nodes of the provided plan grouped by tool, largest groups first"""
+    groups: dict[str, list[str]] = {}
+    sorter: TopologicalSorter = TopologicalSorter(
+        {name: node["dependencies"] for name, node in plan.items()}
+    )
+    # Each group is built on one engine, as the {tool}-{environment} images may be built FROM the tool-only image
+    for name in sorter.static_order():
+        # Each engine builds the base for itself, as a part of build_and_tag
+        if plan[name]["function"] is build_base:
+            continue
+        groups.setdefault(plan[name]["kwargs"]["tool"], []).append(name)
+
+    return sorted(groups.values(), key=len, reverse=True)
+
+
+def collect_image(*, engine: str, image_and_tag: str, latest_tag: str) -> None:
+    """Transfer the provided image from the provided engine to the engine from the environment"""
+    with use_engine(engine=engine) as client:
+        image: docker.models.images.Image = client.images.get(image_and_tag)
+
+    try:
+        if get_local_client().images.get(image_and_tag).id == image.id:
+            LOG.debug(f"{image_and_tag} from {engine} is already available locally")
+            return
+    except docker.errors.ImageNotFound:
+        pass
+
+    LOG.info(f"Collecting {image_and_tag} from {engine}...")
+    # The image is streamed from one engine to the other without being written to disk
+    get_local_client().images.load(image.save(named=image_and_tag))
+    get_local_client().images.get(image_and_tag).tag(
+        constants.IMAGE, tag=latest_tag, force=True
+    )
+
+
+def run_distributed_build_plan(
+    *, plan: dict[str, dict], engines: list[str], jobs: int = 1
+) -> None:
+    """Build the provided plan across the provided docker engines"""
+    if jobs < 1:
+        LOG.error(f"jobs must be at least 1, not {jobs}")
+        sys.exit(1)
+
+    # Each engine has one slot per concurrent build, so the least loaded engines pick up the next group
+    slots: queue.Queue = queue.Queue()
+    for _ in range(jobs):
+        for engine in engines:
+            slots.put(engine)
+
+    failed: dict[str, BaseException] = {}
+    skipped: set[str] = set()
+    lock: threading.Lock = threading.Lock()
+
+    def build_group(*, names: list[str]) -> None:
+        engine: str = slots.get()
+        try:
+            for name in names:
+                node: dict = plan[name]
+                with lock:
+                    blocked_by: set[str] = node["dependencies"].intersection(
+                        skipped.union(failed)
+                    )
+                    if blocked_by:
+                        skipped.add(name)
+                if blocked_by:
+                    LOG.error(f"Skipping {name} because {sorted(blocked_by)} failed")
+                    continue
+
+                LOG.info(f"Building {name} on {engine}...")
+                try:
+                    with use_engine(engine=engine):
+                        node["function"](**node["kwargs"])
+                    tool: str = node["kwargs"]["tool"]
+                    environment: str | None = node["kwargs"]["environment"]
+                    collect_image(
+                        engine=engine,
+                        image_and_tag=get_image_and_tag(
+                            tool=tool, environment=environment
+                        ),
+                        latest_tag=get_latest_tag(tool=tool, environment=environment),
+                    )
+                # The build functions use sys.exit on failures, and remote engines may also fail with connection errors or timeouts from requests
+                # pylint: disable-next=broad-exception-caught
+                except BaseException as exception:
+                    LOG.error(f"Failed to build {name} on {engine}: {exception!r}")
+                    with lock:
+                        failed[name] = exception
+                    continue
+                LOG.info(f"Successfully built {name} on {engine}")
+        finally:
+            slots.put(engine)
+
+    groups: list[list[str]] = get_engine_groups(plan=plan)
+    with ThreadPoolExecutor(
+        max_workers=len(engines) * jobs, thread_name_prefix="build"
+    ) as executor:
+        for future in [executor.submit(build_group, names=names) for names in groups]:
+            future.result()
+
+    if failed or skipped:
+        LOG.error(
+            f"The build failed; {sorted(failed)} failed and {sorted(skipped)} were skipped"
+        )
+        sys.exit(1)
+
+
+def get_source_date_epoch() -> str:
+    """Return the SOURCE_DATE_EPOCH for reproducible builds"""
+    # pylint: disable=import-outside-toplevel
+    import git
+
+    # The last commit that changed the build inputs, which is the same on every build host
+    try:
+        source_date_epoch: str = constants.REPO.git.log(
+            "-1",
+            "--format=%ct",
+            "--",
+            str(constants.BUILD.relative_to(constants.CWD)),
+            str(constants.CONFIG_FILE.relative_to(constants.CWD)),
+        )
+    except git.GitCommandError:
+        LOG.exception("Unable to determine the SOURCE_DATE_EPOCH")
+        sys.exit(1)
+
+    if not source_date_epoch:
+        LOG.error("Unable to determine the SOURCE_DATE_EPOCH from the git history")
+        sys.exit(1)
+
+    return source_date_epoch
+
+
+def add_cache_mounts(*, dockerfile: str) -> str:
+    """Return the provided Dockerfile with the apt and pip cache mounts added to its RUN instructions"""
+    apt_cache: str = f"{constants.CACHE_MOUNTS}/apt"
+    pip_cache: str = f"{constants.CACHE_MOUNTS}/pip"
+    # apt and pip are pointed at the caches by bind mounted config files, so none of it ends up in the image
+    mounts: str = " ".join(
+        [
+            f"--mount=type=cache,id={__project_name__}-apt,target={apt_cache},sharing=locked",
+            f"--mount=type=cache,id={__project_name__}-pip,target={pip_cache},sharing=locked",
+            f"--mount=type=bind,source={constants.CACHE_MOUNTS_CONFIG}/apt.conf,target=/etc/apt/apt.conf.d/99{__project_name__}-cache",
+            f"--mount=type=bind,source={constants.CACHE_MOUNTS_CONFIG}/pip.conf,target=/etc/pip.conf",
+        ]
+    )
+    # apt only creates its partial directories under its default locations
+    setup: str = f"mkdir -p {apt_cache}/archives/partial {apt_cache}/lists/partial &&"
+
+    lines: list[str] = dockerfile.splitlines()
+    start: int | None = None
+    for index, line in enumerate(lines):
+        if start is None and re.match(r"^RUN (?!\[)", line):
+            start = index
+        # Comments within a RUN instruction don't end it
+        if (
+            start is None
+            or line.rstrip().endswith("\\")
+            or line.lstrip().startswith("#")
+        ):
+            continue
+        if re.search(r"\b(apt-get|pip3?)\b", "\n".join(lines[start : index + 1])):
+            lines[start] = f"RUN {mounts} {setup} {lines[start].removeprefix('RUN ')}"
+        start = None
+
+    return "\n".join(lines) + "\n"
+
+
+def write_cache_mounts_config(*, context: Path) -> None:
+    """Write the apt and pip config files which point them at the cache mounts into the provided build context"""
+    directory: Path = context.joinpath(constants.CACHE_MOUNTS_CONFIG)
+    directory.mkdir(parents=True, exist_ok=True)
+    directory.joinpath("apt.conf").write_text(
+        f'Dir::Cache::archives "{constants.CACHE_MOUNTS}/apt/archives";\n'
+        f'Dir::State::lists "{constants.CACHE_MOUNTS}/apt/lists";\n',
+        encoding="UTF-8",
+    )
+    directory.joinpath("pip.conf").write_text(
+        f"[global]\ncache-dir = {constants.CACHE_MOUNTS}/pip\n", encoding="UTF-8"
+    )
+
+
+def prune_cache_mounts() -> None:
+    """Garbage collect the apt and pip cache mounts down to CACHE_MOUNTS_MAX_SIZE, least recently used first"""
+    command: list[str] = [
+        "docker",
+        "buildx",
+        "prune",
+        "--force",
+        "--filter",
+        "type=exec.cachemount",
+        "--keep-storage",
+        constants.CACHE_MOUNTS_MAX_SIZE,
+    ]
+    LOG.debug(f"Running `{' '.join(command)}`")
+    try:
+        subprocess.run(command, check=True, capture_output=True)
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        # The caches are an optimization, so failing to prune them shouldn't fail the build
+        LOG.warning(
+            f"Unable to prune the cache mounts to {constants.CACHE_MOUNTS_MAX_SIZE}"
+        )
+
+
+def get_bake_target(
+    *,
+    name: str,
+    build_kwargs: dict,
+    files: dict[str, Path],
+    directory: Path,
+    contexts: dict[str, str] | None = None,
+    tags: list[str] | None = None,
+    source_date_epoch: str | None = None,
+) -> dict:
+    """Return a bake target equivalent to the provided build kwargs"""
+    # Each target gets its own copy of the context, with the cache mounts added to the Dockerfile
+    context: Path = directory.joinpath(name)
+    for arcname, file in files.items():
+        context.joinpath(arcname).parent.mkdir(parents=True, exist_ok=True)
+        if arcname == build_kwargs["dockerfile"]:
+            context.joinpath(arcname).write_text(
+                add_cache_mounts(dockerfile=file.read_text(encoding="UTF-8")),
+                encoding="UTF-8",
+            )
+            continue
+        shutil.copy2(file, context.joinpath(arcname))
+    write_cache_mounts_config(context=context)
+
+    cache: Path = constants.BUILDKIT_CACHE.joinpath(name)
+    target: dict = {
+        "context": str(context),
+        "dockerfile": build_kwargs["dockerfile"],
+        "target": build_kwargs["target"],
+        "args": build_kwargs["buildargs"],
+        "platforms": [build_kwargs["platform"]],
+        "tags": [build_kwargs["tag"]] if tags is None else tags,
+        "labels": build_kwargs.get("labels", {}),
+        "cache-from": [f"type=local,src={cache}"],
+        "cache-to": [f"type=local,dest={cache},mode=max"],
+        "output": ["type=docker"],
+    }
+    if contexts:
+        target["contexts"] = contexts
+    # Normalize the timestamps in the image and its layers
+    if source_date_epoch:
+        target["args"] = {**target["args"], "SOURCE_DATE_EPOCH": source_date_epoch}
+        target["output"] = ["type=docker,rewrite-timestamp=true"]
+    # Untagged targets are only built as the named context of another target
+    if not target["tags"]:
+        target["output"] = ["type=cacheonly"]
+
+    return target
+
+
+def get_bake_definition(
+    *, plan: dict[str, dict], directory: Path, reproducible: bool = False
+) -> dict:
+    """Return a bake definition which builds every image in the provided plan"""
+    source_date_epoch: str | None = get_source_date_epoch() if reproducible else None
+    definition: dict = {"group": {"default": {"targets": []}}, "target": {}}
+    sorter: TopologicalSorter = TopologicalSorter(
+        {name: node["dependencies"] for name, node in plan.items()}
+    )
+    # The FROM images are named contexts pointing at other targets, so BuildKit builds one graph and each shared stage once
+    for name in sorter.static_order():
+        node: dict = plan[name]
+        definition["group"]["default"]["targets"].append(name)
+        if node["function"] is build_base:
+            # The artifacts are only built as named contexts of the base
+            contexts: dict[str, str] = {}
+            for package in get_artifact_packages():
+                artifact_build_kwargs, files = get_artifact_build(
+                    package=package, reproducible=reproducible
+                )
+                artifact: str = f"artifact-{package}"
+                definition["target"][artifact] = get_bake_target(
+                    name=artifact,
+                    build_kwargs=artifact_build_kwargs,
+                    files=files,
+                    directory=directory,
+                    source_date_epoch=source_date_epoch,
+                )
+                contexts[artifact_build_kwargs["tag"]] = f"target:{artifact}"
+
+            build_kwargs, files = get_base_build(
+                **node["kwargs"], reproducible=reproducible
+            )
+            base_image_and_tag: str = build_kwargs["tag"]
+            definition["target"][name] = get_bake_target(
+                name=name,
+                build_kwargs=build_kwargs,
+                files=files,
+                directory=directory,
+                contexts=contexts,
+                source_date_epoch=source_date_epoch,
+            )
+            continue
+
+        tool: str = node["kwargs"]["tool"]
+        build_config: dict = get_build_config(**node["kwargs"])
+        versioned_tag: str = build_config["versioned_tag"]
+        build_kwargs: dict = {
+            "buildargs": build_config["buildargs"],
+            "dockerfile": "Dockerfile",
             "platform": PLATFORM,
-            "rm": True,
-            "tag": tool_image_and_versioned_tag,
-            "target": target,
+            "tag": f"{constants.IMAGE}:{versioned_tag}",
+            "target": "final",
         }
-        log_image_build(build_kwargs=build_kwargs)
-        LOG.debug(
-            f"Building {tool_image_and_versioned_tag} because it's probably referenced later as a FROM image"
+        contexts: dict[str, str] = {
+            f"{constants.BASE_IMAGE}:{versioned_tag}": "target:base"
+        }
+
+        if build_config["tool_env_exists"]:
+            tool_stage: str = f"{name}-{build_config['tool_target']}"
+            definition["target"][tool_stage] = get_bake_target(
+                name=tool_stage,
+                build_kwargs={
+                    **build_kwargs,
+                    "dockerfile": build_config["dockerfile_tool"],
+                    "target": build_config["tool_target"],
+                },
+                files=get_context_files(
+                    dockerfile=constants.BUILD.joinpath(
+                        build_config["dockerfile_tool"]
+                    ).read_text(encoding="UTF-8"),
+                    dockerfile_name=build_config["dockerfile_tool"],
+                    contexts=[constants.BUILD],
+                ),
+                directory=directory,
+                contexts=contexts,
+                # The tool-only tag belongs to the final target of the tool-only image
+                tags=[],
+                source_date_epoch=source_date_epoch,
+            )
+            contexts = {
+                **contexts,
+                f"{constants.IMAGE}:{build_config['easy_infra_tag_tool_only']}": f"target:{tool_stage}",
+            }
+
+        # Each security tool stage is a single target which is shared by every image that uses it
+        for security_tool in build_config["security_tools"]:
+            artifact_build_kwargs, files = get_artifact_build(
+                package=security_tool,
+                base_image_and_tag=base_image_and_tag,
+                reproducible=reproducible,
+            )
+            artifact: str = f"artifact-{security_tool}"
+            if artifact not in definition["target"]:
+                definition["target"][artifact] = get_bake_target(
+                    name=artifact,
+                    build_kwargs=artifact_build_kwargs,
+                    files=files,
+                    directory=directory,
+                    contexts={base_image_and_tag: "target:base"},
+                    source_date_epoch=source_date_epoch,
+                )
+            build_config["config"]["dockerfile_security_tools"].append(
+                get_security_tool_stage(
+                    security_tool=security_tool,
+                    artifact_image_and_tag=artifact_build_kwargs["tag"],
+                )
+            )
+            contexts = {**contexts, artifact_build_kwargs["tag"]: f"target:{artifact}"}
+
+        rendered: Path = directory.joinpath(f"{name}.rendered")
+        rendered.mkdir(parents=True)
+        render_functions(
+            tool=tool,
+            output_file=rendered.joinpath(constants.FUNCTIONS_OUTPUT_FILE.name),
+        )
+        dockerfile_file: Path = rendered.joinpath(constants.DOCKERFILE_OUTPUT_FILE.name)
+        render_jinja2(
+            template_file=constants.DOCKERFILE_INPUT_FILE,
+            config=build_config["config"],
+            output_file=dockerfile_file,
+        )
+        definition["target"][name] = get_bake_target(
+            name=name,
+            build_kwargs=build_kwargs,
+            files=get_context_files(
+                dockerfile=dockerfile_file.read_text(encoding="UTF-8"),
+                dockerfile_name=dockerfile_file.name,
+                contexts=[rendered, constants.BUILD],
+            ),
+            directory=directory,
+            contexts=contexts,
+            tags=[
+                build_kwargs["tag"],
+                f"{constants.IMAGE}:{build_config['latest_tag']}",
+            ],
+            source_date_epoch=source_date_epoch,
+        )
+
+    return definition
+
+
+def get_baked_image_ids(*, definition: dict) -> dict[str, str]:
+    """Return the local image ID of every tag in the provided bake definition"""
+    return {
+        tag: get_client().images.get(tag).id
+        for target in definition["target"].values()
+        for tag in target["tags"]
+    }
+
+
+def generate_baked_sboms(*, definition: dict) -> None:
+    """Generate the SBOM of each unique easy_infra image in the provided bake definition"""
+    if not shutil.which("syft"):
+        LOG.debug("Skipping the SBOMs because syft is not installed")
+        return
+
+    images: dict[str, str] = {}
+    for target in definition["target"].values():
+        for image_and_tag in target["tags"]:
+            if image_and_tag.startswith(f"{constants.IMAGE}:"):
+                images.setdefault(
+                    get_client().images.get(image_and_tag).id, image_and_tag
+                )
+
+    for image_id, image_and_tag in images.items():
+        generate_sbom(
+            image=get_client().images.get(image_id), image_and_tag=image_and_tag
+        )
+
+
+def run_bake(*, command: list[str], definition: dict) -> None:
+    """Run the provided bake command"""
+    LOG.info(f"Baking {definition['group']['default']['targets']}...")
+    LOG.debug(f"Running `{' '.join(command)}` using {json.dumps(definition)}")
+    try:
+        # The BuildKit progress is streamed straight to the terminal
+        subprocess.run(command, check=True)
+    except subprocess.CalledProcessError:
+        LOG.error(f"Failed to bake {definition['group']['default']['targets']}")
+        sys.exit(1)
+    except FileNotFoundError:
+        LOG.error("The bake backend requires docker with the buildx plugin")
+        sys.exit(1)
+
+
+def bake(
+    *,
+    plan: dict[str, dict],
+    dry_run: bool = False,
+    reproducible: bool = False,
+    verify: bool = False,
+) -> None:
+    """Build the provided plan with a single docker buildx bake invocation"""
+    with build_workspace(name="bake") as workspace:
+        definition: dict = get_bake_definition(
+            plan=plan, directory=workspace, reproducible=reproducible
+        )
+        bake_file: Path = workspace.joinpath("docker-bake.json")
+        bake_file.write_text(json.dumps(definition, indent=2), encoding="UTF-8")
+
+        command: list[str] = [
+            "docker",
+            "buildx",
+            "bake",
+            "--file",
+            str(bake_file),
+            "--progress",
+            "plain",
+        ]
+        if dry_run:
+            LOG.info(
+                f"Would have run `{' '.join(command)}` using {json.dumps(definition)}"
+            )
+            return
+
+        run_bake(command=command, definition=definition)
+        prune_cache_mounts()
+        generate_baked_sboms(definition=definition)
+        if not verify:
+            return
+
+        image_ids: dict[str, str] = get_baked_image_ids(definition=definition)
+        LOG.info(
+            "Rebuilding without the build cache to verify the build is reproducible..."
+        )
+        run_bake(command=[*command, "--no-cache"], definition=definition)
+        differences: list[str] = [
+            f"{tag} ({image_id} then {rebuilt_image_id})"
+            for tag, rebuilt_image_id in get_baked_image_ids(
+                definition=definition
+            ).items()
+            if (image_id := image_ids[tag]) != rebuilt_image_id
+        ]
+        if differences:
+            LOG.error(
+                f"The following images were not reproducible: {', '.join(differences)}"
+            )
+            sys.exit(1)
+        LOG.info(f"Verified that all {len(image_ids)} images are reproducible")
+
+
+def build(
+    tool="all",
+    environment="all",
+    trace=False,
+    debug=False,
+    dry_run=False,
+    jobs=1,
+    backend="docker",
+    changed_since="",
+    reproducible=False,
+    verify=False,
+    engines="",
+) -> None:
+    """Build easy_infra, optionally distributed across a comma separated list of docker engines"""
+    if debug:
+        getLogger().setLevel("DEBUG")
+
+    if backend not in constants.BUILD_BACKENDS:
+        LOG.error(
+            f"Provided an invalid backend of {backend}; must be one of {sorted(constants.BUILD_BACKENDS)}"
+        )
+        sys.exit(1)
+
+    # The classic builder is unable to normalize the timestamps in the layers
+    if (reproducible or verify) and backend != "bake":
+        LOG.error(
+            f"Reproducible and verified builds require the bake backend, but the {backend} backend was provided; rerun with BACKEND=bake"
+        )
+        sys.exit(1)
+
+    # bake distributes its builds with the nodes of the buildx builder instead
+    engine_addresses: list[str] = [
+        engine.strip() for engine in engines.split(",") if engine.strip()
+    ]
+    if engine_addresses and backend != "docker":
+        LOG.error("Distributing builds across engines requires the docker backend")
+        sys.exit(1)
+
+    tools_to_environments = gather_tools_and_environments(
+        tool=tool, environment=environment
+    )
+
+    if changed_since:
+        tools_to_environments = filter_changed_tools_and_environments(
+            tools_to_environments=tools_to_environments, changed_since=changed_since
+        )
+        if not tools_to_environments:
+            LOG.info(f"Nothing needs to be built since {changed_since}")
+            return
+
+    plan: dict[str, dict] = plan_build(
+        tools_to_environments=tools_to_environments,
+        environment=environment,
+        trace=trace,
+    )
+
+    if backend == "bake":
+        bake(
+            plan=plan,
+            dry_run=dry_run,
+            reproducible=reproducible or verify,
+            verify=verify,
+        )
+        return
+
+    if dry_run:
+        sorter: TopologicalSorter = TopologicalSorter(
+            {name: node["dependencies"] for name, node in plan.items()}
+        )
+        for name in sorter.static_order():
+            function, kwargs = plan[name]["function"], plan[name]["kwargs"]
+            LOG.info(f"Would have run {function.__name__}(**{kwargs})")
+        return
+
+    if engine_addresses:
+        # The cache images are pulled by each engine as it needs them
+        run_distributed_build_plan(plan=plan, engines=engine_addresses, jobs=int(jobs))
+        return
+
+    prefetch_images(images_and_tags=get_cache_images(plan=plan))
+    run_build_plan(plan=plan, jobs=int(jobs))
+
+
+def test_image(
+    *,
+    tool: str,
+    environment: str | None,
+    users: list[str],
+    locks: dict[str, threading.Lock],
+) -> None:
+    """Test the provided image with each of the provided users"""
+    from tests import test as run_test  # pylint: disable=import-outside-toplevel
+
+    image_and_tag: str = get_image_and_tag(tool=tool, environment=environment)
+    # The images of a tool share their test files, so they are tested one at a time
+    with locks[tool]:
+        for user in users:
+            LOG.info(
+                f"Testing {image_and_tag} for platform {PLATFORM} with user {user}..."
+            )
+            start: float = time.monotonic()
+            run_test.run_tests(
+                image=image_and_tag,
+                tool=tool,
+                environment=environment or "none",
+                user=user,
+                cleanup=False,
+                security=False,
+            )
+            record_timing(
+                key=get_timing_key(tool=tool, environment=environment),
+                phase=f"test-{user}",
+                duration=time.monotonic() - start,
+            )
+
+
+def scan_image(*, tool: str, environment: str | None) -> None:
+    """Write the SBOM and vuln scan results of both of the tags of the provided image"""
+    from tests import test as run_test  # pylint: disable=import-outside-toplevel
+
+    image_and_tag: str = get_image_and_tag(tool=tool, environment=environment)
+    for tag in (
+        image_and_tag.split(":")[1],
+        get_latest_tag(tool=tool, environment=environment),
+    ):
+        write_sbom(tag=tag)
+        run_test.run_security(tool=tool, environment=environment or "none", tag=tag)
+
+
+def publish_pipeline_image(*, tool: str, environment: str | None) -> None:
+    """Publish both of the tags of the provided image"""
+    image_and_tag: str = get_image_and_tag(tool=tool, environment=environment)
+    image: docker.models.images.Image = get_client().images.get(image_and_tag)
+    digest, stale_tags = get_stale_tags(
+        repository=constants.IMAGE,
+        image=image,
+        tags=[
+            image_and_tag.split(":")[1],
+            get_latest_tag(tool=tool, environment=environment),
+        ],
+    )
+    publish_image(
+        repository=constants.IMAGE, image=image, tags=stale_tags, digest=digest
+    )
+
+
+def run_pipeline(
+    *,
+    plan: dict[str, dict],
+    stages: list[tuple[str, Callable, dict, int]],
+    jobs: int = 1,
+) -> None:
+    """Build the provided plan, streaming each image through the provided stages as it's ready"""
+    for name, _, _, stage_jobs in [("build", None, {}, jobs), *stages]:
+        if stage_jobs < 1:
+            LOG.error(f"The {name} jobs must be at least 1, not {stage_jobs}")
+            sys.exit(1)
+
+    executors: list[ThreadPoolExecutor] = [
+        ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="build")
+    ] + [
+        ThreadPoolExecutor(max_workers=stage_jobs, thread_name_prefix=stage)
+        for stage, _, _, stage_jobs in stages
+    ]
+    failed: dict[str, str] = {}
+    completed: set[str] = set()
+    # Each follow-up future maps to the index of its stage, where 0 is the build
+    indexes: dict[Future, int] = {}
+
+    def on_complete(name: str, future: Future) -> Future | None:
+        index: int = indexes.pop(future, 0)
+        stage: str = "build" if index == 0 else stages[index - 1][0]
+        if (exception := future.exception()) is not None:
+            LOG.error(f"Failed to {stage} {name}: {exception!r}")
+            failed[name] = stage
+            return None
+
+        LOG.info(f"Successfully completed the {stage} of {name}")
+        node: dict = plan[name]
+        # The base image only exists to be built FROM
+        if index == len(stages) or node["function"] is not build_and_tag:
+            completed.add(name)
+            return None
+
+        _, function, kwargs, _ = stages[index]
+        follow_up: Future = executors[index + 1].submit(
+            function,
+            tool=node["kwargs"]["tool"],
+            environment=node["kwargs"]["environment"],
+            **kwargs,
         )
-        CLIENT.images.build(**build_kwargs)
+        indexes[follow_up] = index + 1
+        return follow_up
 
     try:
-        pull_image(image_and_tag=tool_image_and_latest_tag_no_hash)
-        build_kwargs = {
-            "buildargs": buildargs,
-            "cache_from": [tool_image_and_latest_tag_no_hash],
-            "dockerfile": "Dockerfile",
-            "path": str(constants.BUILD),
-            "platform": PLATFORM,
-            "rm": True,
-            "tag": image_and_versioned_tag,
-            "target": "final",
-        }
-        log_image_build(build_kwargs=build_kwargs)
-        LOG.debug(f"Building the usable image {image_and_versioned_tag}")
-        image_tuple = CLIENT.images.build(**build_kwargs)
-        image = image_tuple[0]
-    except docker.errors.BuildError as build_err:
-        LOG.exception(
-            f"Failed to build {image_and_versioned_tag} platform {PLATFORM}...",
-        )
-        log_build_log(build_err=build_err)
-        sys.exit(1)
-
-    # Tag latest
-    LOG.info(f"Tagging {constants.IMAGE}:{latest_tag}...")
-    # force=True is necessary because sometimes the latest images already exist locally because they were pulled or built as a part of being the FROM
-    # of another image. force=True ensures the versioned and latest tags are pointing to the exact same container ID.
-    image.tag(constants.IMAGE, tag=latest_tag, force=True)
+        skipped: set[str] = run_dag(
+            plan=plan, executor=executors[0], on_complete=on_complete
+        )
+    finally:
+        for executor in executors:
+            executor.shutdown()
 
+    if failed or skipped:
+        failures: list[str] = [
+            f"{name} failed to {stage}" for name, stage in sorted(failed.items())
+        ]
+        LOG.error(f"The pipeline failed; {failures} and {sorted(skipped)} were skipped")
+        sys.exit(1)
 
-def build(
-    tool="all", environment="all", trace=False, debug=False, dry_run=False
+    LOG.info(f"Successfully completed the pipeline for {sorted(completed)}")
+
+
+def pipeline(
+    tool="all",
+    environment="all",
+    user="all",
+    trace=False,
+    debug=False,
+    jobs=1,
+    test_jobs=1,
+    scan_jobs=constants.SCAN_JOBS,
+    push=False,
+    publish_jobs=constants.PUBLISH_JOBS,
+    changed_since="",
 ) -> None:
-    """Build easy_infra"""
+    """Build, test, scan, and optionally publish easy_infra as a streaming pipeline"""
     if debug:
         getLogger().setLevel("DEBUG")
 
@@ -992,50 +3287,71 @@ def build(
         tool=tool, environment=environment
     )
 
-    # pylint: disable=redefined-argument-from-local
-    for tool in tools_to_environments:
-        tools: list[str] = [tool]
-        for package in constants.CONFIG["packages"]:
-            if (
-                # It is a helper
-                "helper" in constants.CONFIG["packages"][package]
-                # And it is a helper for the tool we're working on
-                and tool in constants.CONFIG["packages"][package]["helper"]
-                # And it has a security config
-                and "security" in constants.CONFIG["packages"][package]
-            ):
-                tools.append(package)
-        # Render the functions that the tool cares about
-        filtered_config = filter_config(config=constants.CONFIG, tools=tools)
-        if not dry_run:
-            render_jinja2(
-                template_file=constants.FUNCTIONS_INPUT_FILE,
-                config=filtered_config,
-                output_file=constants.FUNCTIONS_OUTPUT_FILE,
-                output_mode=0o755,
-            )
-        else:
-            LOG.info(
-                f"Would have run render_jinja2 on {constants.FUNCTIONS_INPUT_FILE}..."
-            )
+    if changed_since:
+        tools_to_environments = filter_changed_tools_and_environments(
+            tools_to_environments=tools_to_environments,
+            changed_since=changed_since,
+            include_tests=True,
+        )
+        if not tools_to_environments:
+            LOG.info(f"Nothing needs to go through the pipeline since {changed_since}")
+            return
 
-        if environment not in constants.ENVIRONMENTS:
-            # Build and Tag the tool-only tag
-            if not dry_run:
-                build_and_tag(tool=tool, trace=trace)
-            else:
-                LOG.info(f"Would have run build_and_tag({tool=}, {trace=})")
+    users: list[str] = gather_users(user=user)
+    plan: dict[str, dict] = plan_build(
+        tools_to_environments=tools_to_environments,
+        environment=environment,
+        trace=trace,
+    )
 
-        # Build and Tag the tool + environment tags
-        for env in tools_to_environments[tool]["environments"]:
-            if not dry_run:
-                build_and_tag(tool=tool, environment=env, trace=trace)
-            else:
-                LOG.info(f"Would have run build_and_tag({tool=}, {env=}, {trace=})")
+    stages: list[tuple[str, Callable, dict, int]] = [
+        (
+            "test",
+            test_image,
+            {
+                "users": users,
+                "locks": {name: threading.Lock() for name in tools_to_environments},
+            },
+            int(test_jobs),
+        ),
+        ("scan", scan_image, {}, int(scan_jobs)),
+    ]
+    if push:
+        stages.append(("publish", publish_pipeline_image, {}, int(publish_jobs)))
+
+    prefetch_images(images_and_tags=get_cache_images(plan=plan))
+    run_pipeline(plan=plan, stages=stages, jobs=int(jobs))
+
+
+def write_sbom(*, tag: str) -> None:
+    """Write the SBOM of the provided easy_infra tag into the current directory"""
+    file_name = f"sbom.{tag}.json"
+    if Path(file_name).is_file() and Path(file_name).stat().st_size > 0:
+        LOG.info(f"Skipping {file_name} because it already exists...")
+        return
+
+    image_and_tag = f"{constants.IMAGE}:{tag}"
+    image: docker.models.images.Image = get_client().images.get(image_and_tag)
+    LOG.info(f"Writing {file_name} from the SBOM of {image_and_tag}...")
+    sbom: dict = json.loads(
+        generate_sbom(image=image, image_and_tag=image_and_tag).read_text(
+            encoding="UTF-8"
+        )
+    )
+    # The SBOM is shared by every image with the same filesystem
+    source: dict = sbom.setdefault("source", {})
+    describe_image_source(
+        source=source.setdefault("metadata", {}),
+        image=image,
+        image_and_tag=image_and_tag,
+    )
+    if "name" in source:
+        source["name"], source["version"] = constants.IMAGE, tag
+    Path(file_name).write_text(json.dumps(sbom), encoding="UTF-8")
 
 
-def sbom(tool="all", environment="all", debug=False) -> None:
-    """Generate an SBOM"""
+def sbom(tool="all", environment="all", debug=False, jobs=constants.SCAN_JOBS) -> None:
+    """Generate an SBOM for each unique image, using up to jobs concurrent scans"""
     if debug:
         getLogger().setLevel("DEBUG")
 
@@ -1047,46 +3363,67 @@ def sbom(tool="all", environment="all", debug=False) -> None:
         tools_to_environments=tools_to_environments, environment=environment
     )
 
-    for tool in tools_to_environments:
-        try:
-            for iteration, tag in enumerate(tags):
-                if (
-                    iteration % 2 == 1
-                ):  # True when iteration is odd (should be the latest tag)
-                    prior_tag = tags[iteration - 1]
-                    prior_file_name = f"sbom.{prior_tag}.json"
-                file_name = f"sbom.{tag}.json"
-
-                if Path(file_name).is_file() and Path(file_name).stat().st_size > 0:
-                    LOG.info(f"Skipping {file_name} because it already exists...")
-                    continue
+    run_scans(
+        function=write_sbom,
+        kwargs={},
+        images=group_tags_by_image(tags=tags),
+        jobs=int(jobs),
+    )
 
-                if iteration % 2 == 1:  # Again, latest tag
-                    LOG.info(
-                        f"Copying {prior_file_name} into {file_name} since they are the same..."
-                    )
-                    shutil.copy(prior_file_name, file_name)
-                    continue
 
-                image_and_tag = f"{constants.IMAGE}:{tag}"
-                LOG.info(f"Generating {file_name} from {image_and_tag}...")
-                subprocess.run(
-                    [
-                        "syft",
-                        f"docker:{image_and_tag}",
-                        "-o",
-                        "json",
-                        "--file",
-                        file_name,
-                    ],
-                    capture_output=True,
-                    check=True,
-                )
-        except subprocess.CalledProcessError as error:
-            LOG.error(
-                f"stdout: {error.stdout.decode('UTF-8')}, stderr: {error.stderr.decode('UTF-8')}"
-            )
-            sys.exit(1)
+def check_imports(debug: bool = False) -> None:
+    """Ensure that importing easy_infra.constants and easy_infra.utils is fast and side-effect free"""
+    if debug:
+        getLogger().setLevel("DEBUG")
+
+    # Timed in a fresh interpreter, since this process already imported everything
+    code: str = """
+import json, sys, time
+start = time.perf_counter()
+from easy_infra import constants, utils
+duration = time.perf_counter() - start
+print(json.dumps({
+    "duration": duration,
+    "constants": sorted(name for name in constants.LAZY_CONSTANTS if name in vars(constants)),
+    "clients": sorted(utils.ENGINES),
+    "modules": sorted(name for name in ("docker", "git", "jinja2", "requests") if name in sys.modules),
+    "tests": "tests.test" in sys.modules,
+}))
+"""
+    try:
+        out = subprocess.run(
+            [sys.executable, "-c", code],
+            capture_output=True,
+            check=True,
+            cwd=constants.CWD,
+        )
+    except subprocess.CalledProcessError as error:
+        LOG.error(
+            f"stdout: {error.stdout.decode('UTF-8')}, stderr: {error.stderr.decode('UTF-8')}"
+        )
+        sys.exit(1)
+    result: dict = json.loads(out.stdout.decode("UTF-8").splitlines()[-1])
+
+    side_effects: list[str] = []
+    if result["constants"]:
+        side_effects.append(f"loaded the {result['constants']} constants")
+    if result["clients"]:
+        side_effects.append("connected to docker")
+    if result["modules"]:
+        side_effects.append(f"imported {result['modules']}")
+    if result["tests"]:
+        side_effects.append("imported the tests")
+    if side_effects:
+        LOG.error(f"Importing easy_infra {' and '.join(side_effects)}")
+        sys.exit(1)
+
+    if result["duration"] > constants.IMPORT_TIME_BUDGET:
+        LOG.error(
+            f"Importing easy_infra took {result['duration']:.3f}s, which is over the {constants.IMPORT_TIME_BUDGET}s budget"
+        )
+        sys.exit(1)
+
+    LOG.info(f"Importing easy_infra took {result['duration']:.3f}s")
 
 
 def test(
@@ -1095,14 +3432,28 @@ def test(
     user: str = "all",
     debug: bool = False,
     tag: str = "",
+    changed_since: str = "",
 ) -> None:
     """Test easy_infra"""
+    # The tests import this module, so they are only imported by the functions which run them
+    from tests import test as run_test  # pylint: disable=import-outside-toplevel
+
     if debug:
         getLogger().setLevel("DEBUG")
 
     tools_to_environments = gather_tools_and_environments(
         tool=tool, environment=environment
     )
+
+    if changed_since:
+        tools_to_environments = filter_changed_tools_and_environments(
+            tools_to_environments=tools_to_environments,
+            changed_since=changed_since,
+            include_tests=True,
+        )
+        if not tools_to_environments:
+            LOG.info(f"Nothing needs to be tested since {changed_since}")
+            return
     users: list[str] = gather_users(user=user)
 
     if tag:
@@ -1128,6 +3479,7 @@ def test(
             LOG.info(
                 f"Testing {image_and_versioned_tag} for platform {PLATFORM} with user {user}..."
             )
+            start: float = time.monotonic()
             run_test.run_tests(
                 image=image_and_versioned_tag,
                 tool=tool,
@@ -1135,10 +3487,49 @@ def test(
                 user=user,
                 mount_local_files=mount_local_files,
             )
+            # The durations are only comparable when a single image was tested
+            if len(image_and_versioned_tags) == 1 and tool in constants.TOOLS:
+                record_timing(
+                    key=get_timing_key(tool=tool, environment=environment),
+                    phase=f"test-{user}",
+                    duration=time.monotonic() - start,
+                )
+
+
+def shard(jobs: str = "[]", debug: bool = False) -> None:
+    """Build, scan, and test the provided JSON list of jobs from a sharded github actions matrix"""
+    if debug:
+        getLogger().setLevel("DEBUG")
+
+    shard_jobs: list[dict[str, str]] = json.loads(jobs)
+    # A shard can have multiple users of the same image, which only need it to be built and scanned once
+    images: dict[tuple[str, str], bool] = {}
+    for job in shard_jobs:
+        image: tuple[str, str] = (job["tool"], job["environment"])
+        images[image] = images.get(image, False) or job.get("user", "root") == "root"
+
+    for (tool, environment), scan in images.items():
+        build(tool=tool, environment=environment, debug=debug)
+        # Only the root user jobs scan the image, the same as the unsharded matrix
+        if scan:
+            sbom(tool=tool, environment=environment, debug=debug)
+            vulnscan(tool=tool, environment=environment, debug=debug)
+
+    for job in shard_jobs:
+        test(
+            tool=job["tool"],
+            environment=job["environment"],
+            user=job.get("user", "all"),
+            debug=debug,
+        )
+
 
+def vulnscan(
+    tool="all", environment="all", debug=False, jobs=constants.SCAN_JOBS
+) -> None:
+    """Scan each unique easy_infra image for vulns, using up to jobs concurrent scans"""
+    from tests import test as run_test  # pylint: disable=import-outside-toplevel
 
-def vulnscan(tool="all", environment="all", debug=False) -> None:
-    """Scan easy_infra for vulns"""
     if debug:
         getLogger().setLevel("DEBUG")
 
@@ -1150,12 +3541,151 @@ def vulnscan(tool="all", environment="all", debug=False) -> None:
         tools_to_environments=tools_to_environments, environment=environment
     )
 
+    run_scans(
+        function=run_test.run_security,
+        kwargs={
+            "tool": tool,
+            "environment": environment,
+            "db_version": get_vulnerability_db_version(),
+        },
+        images=group_tags_by_image(tags=tags),
+        jobs=int(jobs),
+    )
+
+
+def get_remote_digest(*, image_and_tag: str) -> str | None:
+    """Return the digest that the provided tag points to in its registry, if it exists"""
+    # Unlike get_registry_digest, this is never cached
+    try:
+        return get_client().images.get_registry_data(name=image_and_tag).id
+    except docker.errors.APIError as error:
+        LOG.debug(f"Unable to find {image_and_tag} in the registry: {error}")
+        return None
+
+
+def get_push_waves(*, layers: dict[str, list[str]]) -> list[list[str]]:
+    """Group the provided images into waves which can be pushed concurrently"""
+    pushed: set[str] = set()
+    pending: list[str] = sorted(layers, key=lambda image_id: -len(layers[image_id]))
+    waves: list[list[str]] = []
+    while pending:
+        wave: list[str] = []
+        claimed: set[str] = set()
+        # Images which share an unpushed layer wait for a later wave, so each layer is only uploaded once
+        for image_id in pending:
+            unpushed: set[str] = set(layers[image_id]) - pushed
+            if unpushed & claimed:
+                continue
+            wave.append(image_id)
+            claimed |= unpushed
+        waves.append(wave)
+        pushed |= claimed
+        pending = [image_id for image_id in pending if image_id not in wave]
+
+    return waves
+
+
+def push_image(*, image_and_tag: str) -> str:
+    """Push the provided image, returning the digest of its manifest in the registry"""
+    repository, tag = image_and_tag.rsplit(":", 1)
+    LOG.info(f"Pushing {image_and_tag}...")
+    digest: str = ""
+    for line in get_client().api.push(repository, tag=tag, stream=True, decode=True):
+        if "error" in line:
+            LOG.error(f"Failed to push {image_and_tag}: {line['error']}")
+            sys.exit(1)
+        if "aux" in line and "Digest" in line["aux"]:
+            digest = line["aux"]["Digest"]
+
+    if not digest:
+        LOG.error(f"Unable to determine the digest of {image_and_tag} after pushing it")
+        sys.exit(1)
+
+    return digest
+
+
+def tag_remote_image(*, repository: str, digest: str, tag: str) -> None:
+    """Point the provided tag at an image which is already in the registry"""
+    image_and_tag: str = f"{repository}:{tag}"
+    LOG.info(f"Tagging {repository}@{digest} as {image_and_tag} in the registry...")
+    try:
+        subprocess.run(
+            [
+                "docker",
+                "buildx",
+                "imagetools",
+                "create",
+                # Copy the manifest as is, rather than wrapping it in a new index
+                "--prefer-index=false",
+                "--tag",
+                image_and_tag,
+                f"{repository}@{digest}",
+            ],
+            capture_output=True,
+            check=True,
+        )
+    except subprocess.CalledProcessError as error:
+        LOG.error(
+            f"stdout: {error.stdout.decode('UTF-8')}, stderr: {error.stderr.decode('UTF-8')}"
+        )
+        sys.exit(1)
+    except FileNotFoundError:
+        LOG.error("Publishing requires docker with the buildx plugin")
+        sys.exit(1)
+
+
+def get_stale_tags(
+    *, repository: str, image: docker.models.images.Image, tags: list[str]
+) -> tuple[str | None, list[str]]:
+    """Return the registry digest of the provided image, and the provided tags which aren't current"""
+    local_digests: set[str] = {
+        repo_digest.split("@")[1]
+        for repo_digest in image.attrs.get("RepoDigests") or []
+        if repo_digest.split("@")[0] == repository
+    }
+    digest: str | None = None
+    stale_tags: list[str] = []
+    for tag in tags:
+        if (
+            remote_digest := get_remote_digest(image_and_tag=f"{repository}:{tag}")
+        ) in local_digests:
+            LOG.info(f"Skipping {repository}:{tag} because it is already current")
+            digest = remote_digest
+        else:
+            stale_tags.append(tag)
+
+    return digest, stale_tags
+
+
+def publish_image(
+    *,
+    repository: str,
+    image: docker.models.images.Image,
+    tags: list[str],
+    digest: str | None = None,
+) -> str:
+    """Publish the provided image under the provided tags, pushing it unless a digest is provided"""
+    tags = list(tags)
+    if tags and digest is None:
+        digest = push_image(image_and_tag=f"{repository}:{tags.pop(0)}")
+
+    # The other tags only get a manifest which points to the pushed image
     for tag in tags:
-        run_test.run_security(tool=tool, environment=environment, tag=tag)
+        tag_remote_image(repository=repository, digest=digest, tag=tag)
 
+    return digest
 
-def publish(tool="all", environment="all", debug=False, dry_run=False) -> None:
-    """Publish easy_infra"""
+
+def publish(
+    tool="all",
+    environment="all",
+    debug=False,
+    dry_run=False,
+    changed_since="",
+    jobs=constants.PUBLISH_JOBS,
+    registry="",
+) -> None:
+    """Publish easy_infra, optionally to another registry instead of docker hub"""
     if debug:
         getLogger().setLevel("DEBUG")
 
@@ -1163,22 +3693,377 @@ def publish(tool="all", environment="all", debug=False, dry_run=False) -> None:
         tool=tool, environment=environment
     )
 
+    if changed_since:
+        tools_to_environments = filter_changed_tools_and_environments(
+            tools_to_environments=tools_to_environments, changed_since=changed_since
+        )
+        if not tools_to_environments:
+            LOG.info(f"Nothing needs to be published since {changed_since}")
+            return
+
     tags = get_tags(
         tools_to_environments=tools_to_environments, environment=environment
     )
+    repository: str = f"{registry}/{constants.IMAGE}" if registry else constants.IMAGE
 
+    # Each image is usually tagged with both a versioned and a latest tag
+    images: dict[str, docker.models.images.Image] = {}
+    image_tags: dict[str, list[str]] = {}
     # pylint: disable=redefined-argument-from-local
     for tag in tags:
         image_and_tag = f"{constants.IMAGE}:{tag}"
-        if dry_run:
-            LOG.info(f"Would have run CLIENT.images.push(repository={image_and_tag}")
-        else:
-            LOG.info(f"Pushing {image_and_tag} to docker hub...")
-            CLIENT.images.push(repository=image_and_tag)
+        try:
+            image: docker.models.images.Image = get_client().images.get(image_and_tag)
+        except docker.errors.ImageNotFound:
+            LOG.error(f"Unable to find {image_and_tag}; has it been built?")
+            sys.exit(1)
+        images.setdefault(image.id, image)
+        image_tags.setdefault(image.id, []).append(tag)
+        if registry and not dry_run:
+            image.tag(repository, tag=tag)
+
+    with ThreadPoolExecutor(
+        max_workers=int(jobs), thread_name_prefix="publish"
+    ) as executor:
+        futures: dict = {
+            image_id: executor.submit(
+                get_stale_tags,
+                repository=repository,
+                image=image,
+                tags=image_tags[image_id],
+            )
+            for image_id, image in images.items()
+        }
+    stale: dict[str, tuple[str | None, list[str]]] = {
+        image_id: future.result()
+        for image_id, future in futures.items()
+        if future.result()[1]
+    }
+
+    # Images which are already in the registry under another tag don't upload any layers
+    waves: list[list[str]] = get_push_waves(
+        layers={
+            image_id: (
+                images[image_id].attrs["RootFS"]["Layers"] if digest is None else []
+            )
+            for image_id, (digest, _) in stale.items()
+        }
+    )
+    if dry_run:
+        for wave in waves:
+            LOG.info(
+                f"Would have published {[f'{repository}:{tag}' for image_id in wave for tag in stale[image_id][1]]} concurrently"
+            )
+        return
+
+    for wave in waves:
+        with ThreadPoolExecutor(
+            max_workers=int(jobs), thread_name_prefix="push"
+        ) as executor:
+            for future in [
+                executor.submit(
+                    publish_image,
+                    repository=repository,
+                    image=images[image_id],
+                    tags=stale[image_id][1],
+                    digest=stale[image_id][0],
+                )
+                for image_id in wave
+            ]:
+                future.result()
 
     LOG.info("Done publishing the easy_infra Docker images")
 
 
+def get_chain_ids(*, diff_ids: list[str]) -> list[str]:
+    """Return the chain ID of each of the provided layers"""
+    chain_ids: list[str] = []
+    for diff_id in diff_ids:
+        if chain_ids:
+            diff_id = (
+                "sha256:"
+                + hashlib.sha256(f"{chain_ids[-1]} {diff_id}".encode()).hexdigest()
+            )
+        chain_ids.append(diff_id)
+
+    return chain_ids
+
+
+def add_json_to_tar(*, tar: tarfile.TarFile, name: str, content: dict | list) -> None:
+    """Add the provided content to the provided tarball as a JSON file"""
+    data: bytes = json.dumps(content).encode("UTF-8")
+    tarinfo = tarfile.TarInfo(name=name)
+    tarinfo.size = len(data)
+    tar.addfile(tarinfo, io.BytesIO(data))
+
+
+def save_images(*, images_and_tags: list[str], directory: Path) -> dict:
+    """Save the provided images into the provided directory, storing each blob only once"""
+    manifests: dict[str, dict] = {}
+    index: dict[tuple, dict] = {}
+    blobs: dict[str, Path] = {}
+    save_file: Path = directory.joinpath("save.tar")
+    for image_and_tag in images_and_tags:
+        try:
+            image: docker.models.images.Image = get_client().images.get(image_and_tag)
+        except docker.errors.ImageNotFound:
+            LOG.error(f"Unable to find {image_and_tag}; has it been built?")
+            sys.exit(1)
+
+        LOG.info(f"Exporting {image_and_tag}...")
+        with open(save_file, "wb") as file:
+            for chunk in image.save(named=image_and_tag):
+                file.write(chunk)
+
+        with tarfile.open(save_file) as tar:
+            for member in tar.getmembers():
+                if member.name == "manifest.json":
+                    for entry in json.load(tar.extractfile(member)):
+                        manifest: dict = manifests.setdefault(
+                            entry["Config"], {**entry, "RepoTags": []}
+                        )
+                        manifest["RepoTags"].extend(
+                            repo_tag
+                            for repo_tag in entry.get("RepoTags") or []
+                            if repo_tag not in manifest["RepoTags"]
+                        )
+                elif member.name == "index.json":
+                    for entry in json.load(tar.extractfile(member))["manifests"]:
+                        key: tuple = (
+                            entry["digest"],
+                            json.dumps(entry.get("annotations", {}), sort_keys=True),
+                        )
+                        index[key] = entry
+                # Everything else is named by its digest, so the blobs which are shared by multiple images are only stored once
+                elif (
+                    member.isfile()
+                    and member.name not in {"oci-layout", "repositories"}
+                    and member.name not in blobs
+                ):
+                    blob: Path = directory.joinpath("blobs", member.name)
+                    blob.parent.mkdir(parents=True, exist_ok=True)
+                    with open(blob, "wb") as file:
+                        shutil.copyfileobj(tar.extractfile(member), file)
+                    blobs[member.name] = blob
+        save_file.unlink()
+
+    return {
+        "manifests": list(manifests.values()),
+        "index": list(index.values()),
+        "blobs": blobs,
+    }
+
+
+def export_images(
+    tool="all", environment="all", archive=str(constants.IMAGE_ARCHIVE), debug=False
+) -> None:
+    """Export the images to a single zstd compressed OCI layout archive"""
+    if debug:
+        getLogger().setLevel("DEBUG")
+
+    tools_to_environments = gather_tools_and_environments(
+        tool=tool, environment=environment
+    )
+    images_and_tags: list[str] = [
+        f"{constants.IMAGE}:{tag}"
+        for tag in get_tags(
+            tools_to_environments=tools_to_environments, environment=environment
+        )
+    ]
+
+    with tempfile.TemporaryDirectory() as directory:
+        saved: dict = save_images(
+            images_and_tags=images_and_tags, directory=Path(directory)
+        )
+        configs: set[str] = {manifest["Config"] for manifest in saved["manifests"]}
+
+        LOG.info(
+            f"Compressing {len(saved['blobs'])} unique blobs from {len(images_and_tags)} tags into {archive}..."
+        )
+        command: list[str] = ["zstd", "-T0", "-q", "-f", "-o", archive]
+        try:
+            process = subprocess.Popen(command, stdin=subprocess.PIPE)
+        except FileNotFoundError:
+            LOG.error("Exporting images requires zstd")
+            sys.exit(1)
+
+        # The manifest and image configs go first, so that import_images knows which layers it needs before any of them arrive
+        with tarfile.open(fileobj=process.stdin, mode="w|") as tar:
+            add_json_to_tar(tar=tar, name="manifest.json", content=saved["manifests"])
+            if saved["index"]:
+                add_json_to_tar(
+                    tar=tar,
+                    name="index.json",
+                    content={"schemaVersion": 2, "manifests": saved["index"]},
+                )
+                add_json_to_tar(
+                    tar=tar, name="oci-layout", content={"imageLayoutVersion": "1.0.0"}
+                )
+            for name, blob in sorted(
+                saved["blobs"].items(), key=lambda item: item[0] not in configs
+            ):
+                tar.add(str(blob), arcname=name)
+        process.stdin.close()
+
+        if process.wait() != 0:
+            LOG.error(f"Failed to compress the images into {archive}")
+            sys.exit(1)
+
+    LOG.info(f"Exported {len(images_and_tags)} tags to {archive}")
+
+
+def is_containerd_image_store() -> bool:
+    """Return True if the engine uses the containerd image store"""
+    driver_status: list = get_client().info().get("DriverStatus") or []
+    return ["driver-type", "io.containerd.snapshotter.v1"] in driver_status
+
+
+def get_index_repo_tag(*, entry: dict) -> str | None:
+    """Return the image name of the provided OCI index entry in the form of a RepoTag"""
+    name: str = entry.get("annotations", {}).get("io.containerd.image.name", "")
+    return name.removeprefix("docker.io/").removeprefix("library/") or None
+
+
+def import_images(archive=str(constants.IMAGE_ARCHIVE), debug=False) -> None:
+    """Import the images from an archive created by export_images"""
+    if debug:
+        getLogger().setLevel("DEBUG")
+
+    local_images: set[str] = set()
+    local_chain_ids: set[str] = set()
+    for image in get_client().images.list():
+        local_images.add(image.id)
+        local_chain_ids.update(
+            get_chain_ids(diff_ids=image.attrs["RootFS"].get("Layers") or [])
+        )
+    skip_layers: bool = not is_containerd_image_store()
+
+    command: list[str] = ["zstd", "-d", "-c", "-q", archive]
+    try:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    except FileNotFoundError:
+        LOG.error("Importing images requires zstd")
+        sys.exit(1)
+
+    with tempfile.TemporaryDirectory() as directory:
+        load_file: Path = Path(directory).joinpath("load.tar")
+        manifests: list[dict] = []
+        config_files: set[str] = set()
+        configs: dict[str, bytes] = {}
+        index: dict | None = None
+        needed: set[str] | None = None
+        skipped: int = 0
+        with (
+            tarfile.open(fileobj=process.stdout, mode="r|") as source,
+            tarfile.open(load_file, mode="w") as target,
+        ):
+            for member in source:
+                if member.name == "manifest.json":
+                    manifests = json.load(source.extractfile(member))
+                    config_files = {manifest["Config"] for manifest in manifests}
+                    continue
+                if member.name in config_files:
+                    configs[member.name] = source.extractfile(member).read()
+                    target.addfile(member, io.BytesIO(configs[member.name]))
+                    continue
+                # The index is added last, once it's known which images are missing
+                if member.name == "index.json":
+                    index = json.load(source.extractfile(member))
+                    continue
+                # The containerd image store loads images from the OCI index, which requires all of their blobs
+                if not skip_layers:
+                    target.addfile(
+                        member, source.extractfile(member) if member.isfile() else None
+                    )
+                    continue
+                # Without the OCI index, the engine loads the images from manifest.json, which allows layers that it already has to be left out
+                if member.name == "oci-layout":
+                    continue
+
+                # The configs come first, so every one of them is available once the first layer arrives
+                if needed is None:
+                    needed = set()
+                    for manifest in manifests:
+                        config: bytes = configs[manifest["Config"]]
+                        if (
+                            "sha256:" + hashlib.sha256(config).hexdigest()
+                            in local_images
+                        ):
+                            continue
+                        chain_ids: list[str] = get_chain_ids(
+                            diff_ids=json.loads(config)["rootfs"]["diff_ids"]
+                        )
+                        needed.update(
+                            layer
+                            for layer, chain_id in zip(manifest["Layers"], chain_ids)
+                            if chain_id not in local_chain_ids
+                        )
+
+                if member.name in needed:
+                    target.addfile(member, source.extractfile(member))
+                elif member.isfile():
+                    skipped += 1
+
+            # Images which are already available locally only need to be tagged
+            index_entries: list[dict] = (index or {}).get("manifests", [])
+            missing: list[dict] = []
+            for manifest in manifests:
+                repo_tags: list[str] = manifest.get("RepoTags") or []
+                # The containerd image store identifies images by their manifest instead of their config
+                image_ids: set[str] = {
+                    "sha256:" + hashlib.sha256(configs[manifest["Config"]]).hexdigest()
+                }.union(
+                    entry["digest"]
+                    for entry in index_entries
+                    if get_index_repo_tag(entry=entry) in repo_tags
+                )
+                if not (local_image_ids := image_ids.intersection(local_images)):
+                    missing.append(manifest)
+                    continue
+                image_id: str = sorted(local_image_ids)[0]
+                for repo_tag in repo_tags:
+                    repository, image_tag = repo_tag.rsplit(":", 1)
+                    get_client().images.get(image_id).tag(
+                        repository, tag=image_tag, force=True
+                    )
+            add_json_to_tar(tar=target, name="manifest.json", content=missing)
+            if index is not None and not skip_layers:
+                missing_repo_tags: set[str] = {
+                    repo_tag
+                    for manifest in missing
+                    for repo_tag in manifest.get("RepoTags") or []
+                }
+                add_json_to_tar(
+                    tar=target,
+                    name="index.json",
+                    content={
+                        **index,
+                        # Entries which can't be matched to an image are kept
+                        "manifests": [
+                            entry
+                            for entry in index_entries
+                            if get_index_repo_tag(entry=entry)
+                            in missing_repo_tags.union({None})
+                        ],
+                    },
+                )
+
+        if process.wait() != 0:
+            LOG.error(f"Failed to decompress {archive}")
+            sys.exit(1)
+
+        if missing:
+            LOG.info(
+                f"Loading {len(missing)} images from {archive}, skipping {skipped} blobs which are already available locally..."
+            )
+            with open(load_file, "rb") as file:
+                get_client().images.load(file)
+
+    LOG.info(
+        f"Imported {len(manifests)} images from {archive}; {len(manifests) - len(missing)} were already available locally"
+    )
+
+
 def tag(push=False, debug=False) -> None:
     """Tag a release commit"""
     if debug:
@@ -1210,3 +4095,166 @@ def tag(push=False, debug=False) -> None:
     if push:
         LOG.info(f"Pushing the {version_tag} tag to GitHub...")
         remote.push(version_tag)
+
+
+def get_image_last_used(*, image: docker.models.images.Image, usage: dict) -> float:
+    """Return when the provided image was last used, tagged, or created"""
+    timestamps: list[float] = [usage.get(image.id, 0.0)]
+    for timestamp in (
+        image.attrs.get("Metadata", {}).get("LastTagTime", ""),
+        image.attrs.get("Created", ""),
+    ):
+        # Docker timestamps have nanosecond precision, which strptime doesn't support
+        if timestamp and not timestamp.startswith("0001-"):
+            timestamps.append(
+                calendar.timegm(time.strptime(timestamp[:19], "%Y-%m-%dT%H:%M:%S"))
+            )
+
+    return max(timestamps)
+
+
+def get_protected_images() -> set[str]:
+    """Return the images and tags which must never be evicted, because builds use them as a cache"""
+    tools_to_environments: dict = gather_tools_and_environments(
+        tool="all", environment="all"
+    )
+    plan: dict[str, dict] = plan_build(
+        tools_to_environments=tools_to_environments, environment="all"
+    )
+    return set(get_cache_images(plan=plan))
+
+
+def get_images_size() -> int:
+    """Return the disk space used by all of the images on the host"""
+    return get_client().df()["LayersSize"]
+
+
+def gc_images(*, max_size: int, dry_run: bool = False) -> int:
+    """Evict the least recently used easy_infra images until they fit in max_size bytes"""
+    protected: set[str] = get_protected_images()
+    usage: dict[str, float] = read_image_usage()
+    images: dict[str, docker.models.images.Image] = {
+        image.id: image
+        for repository in (
+            constants.IMAGE,
+            constants.BASE_IMAGE,
+            constants.ARTIFACT_IMAGE,
+        )
+        for image in get_client().images.list(name=repository)
+    }
+    # Layers which are shared with other images aren't freed when the image is removed
+    unique_sizes: dict[str, int] = {
+        image["Id"]: image["Size"] - max(image["SharedSize"], 0)
+        for image in get_client().df()["Images"]
+    }
+
+    size: int = get_images_size()
+    reclaimed: int = 0
+    for image in sorted(
+        images.values(), key=lambda image: get_image_last_used(image=image, usage=usage)
+    ):
+        if size - reclaimed <= max_size:
+            break
+        if protected.intersection(image.tags):
+            LOG.debug(f"Not evicting {image.tags} because it is used as a build cache")
+            continue
+
+        if dry_run:
+            LOG.info(f"Would have evicted {image.short_id} {image.tags}")
+        else:
+            LOG.info(f"Evicting {image.short_id} {image.tags}...")
+            try:
+                get_client().images.remove(image.id, force=True)
+            except docker.errors.APIError:
+                LOG.warning(f"Unable to evict {image.short_id}, skipping...")
+                continue
+        reclaimed += unique_sizes.get(image.id, 0)
+        usage.pop(image.id, None)
+
+    if not dry_run:
+        with USAGE_LOCK:
+            constants.IMAGE_USAGE.parent.mkdir(parents=True, exist_ok=True)
+            constants.IMAGE_USAGE.write_text(
+                json.dumps(usage, indent=2), encoding="UTF-8"
+            )
+        # Removing images can free shared layers as well, so measure instead of estimating
+        reclaimed = size - get_images_size()
+
+    return reclaimed
+
+
+def get_cache_entries() -> list[Path]:
+    """Return the local build cache entries that can be evicted"""
+    entries: list[Path] = []
+    for directory in (
+        constants.CONTEXTS,
+        constants.BUILDKIT_CACHE,
+        constants.SBOMS,
+        constants.VULNS,
+    ):
+        if directory.is_dir():
+            entries.extend(directory.iterdir())
+
+    return entries
+
+
+def get_path_size(*, path: Path) -> int:
+    """Return the size of the provided file, or of all of the files under the provided directory"""
+    if path.is_file():
+        return path.stat().st_size
+
+    return sum(file.stat().st_size for file in path.rglob("*") if file.is_file())
+
+
+def gc_cache(*, max_size: int, dry_run: bool = False) -> int:
+    """Evict the least recently used build cache entries until they fit in max_size bytes"""
+    entries: dict[Path, int] = {
+        entry: get_path_size(path=entry) for entry in get_cache_entries()
+    }
+    size: int = sum(entries.values())
+    reclaimed: int = 0
+    for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+        if size - reclaimed <= max_size:
+            break
+        if dry_run:
+            LOG.info(f"Would have evicted {entry}")
+        else:
+            LOG.info(f"Evicting {entry}...")
+            if entry.is_dir():
+                shutil.rmtree(entry)
+            else:
+                entry.unlink()
+        reclaimed += entries[entry]
+
+    if dry_run:
+        LOG.info(f"Would have pruned the builder cache down to {max_size} bytes")
+        return reclaimed
+
+    response: dict = get_client().api.prune_builds(keep_storage=max_size)
+    reclaimed += response.get("SpaceReclaimed") or 0
+
+    return reclaimed
+
+
+def gc(
+    max_size_gb=constants.GC_MAX_SIZE_GB,
+    max_cache_size_gb=constants.GC_MAX_CACHE_SIZE_GB,
+    dry_run=False,
+    debug=False,
+) -> None:
+    """Garbage collect the local easy_infra images and build cache once they exceed their budgets"""
+    if debug:
+        getLogger().setLevel("DEBUG")
+
+    reclaimed_images: int = gc_images(
+        max_size=int(float(max_size_gb) * 1_000_000_000), dry_run=dry_run
+    )
+    reclaimed_cache: int = gc_cache(
+        max_size=int(float(max_cache_size_gb) * 1_000_000_000), dry_run=dry_run
+    )
+
+    verb: str = "Would have reclaimed" if dry_run else "Reclaimed"
+    LOG.info(
+        f"{verb} {(reclaimed_images + reclaimed_cache) / 1_000_000_000:.2f}GB; {reclaimed_images / 1_000_000_000:.2f}GB of images and "
+        f"{reclaimed_cache / 1_000_000_000:.2f}GB of build cache"
+    )
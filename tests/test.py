@@ -4,6 +4,7 @@ Test Functions
 """
 
 import copy
+import json
 import os
 import re
 import shutil
@@ -16,7 +17,7 @@ from typing import Optional, Union
 
 import docker
 
-from easy_infra import constants, utils
+from easy_infra import config, constants, utils
 
 # Globals
 CWD = Path().absolute()
@@ -78,61 +79,34 @@ def test_version_arguments(
         utils.gather_tools_and_environments(tool=tool, environment=environment)
     )
 
+    compiled_config: config.CompiledConfig = constants.COMPILED_CONFIG
+
     # Find the package name for the provided tool
     package_for_tool: str = utils.get_package_name(tool=tool)
 
-    # Assemble the packages to test starting with the environment packages
+    # Assemble the packages to test starting with the environment packages, then the tool package, the packages referenced in the security section
+    # of the provided tool, and the packages which "help" the provided tool
     packages_to_test: list[str] = []
     for env in tools_to_environments[tool]["environments"]:
-        for env_package in constants.CONFIG["environments"][env]["packages"]:
-            packages_to_test.append(env_package)
+        packages_to_test.extend(compiled_config.environment_packages[env])
+    packages_to_test.append(package_for_tool)
+    packages_to_test.extend(compiled_config.security_tools[package_for_tool])
+    packages_to_test.extend(compiled_config.get_helpers(tool=tool))
 
     # Populate a list of version commands to test
-    for package in constants.CONFIG["packages"]:
-        # Ignore already identified packages
-        if package in packages_to_test:
-            LOG.debug(f"{package} is already on the list to test, not re-adding it...")
-            continue
-
+    commands_to_test: set[str] = set()
+    for package in dict.fromkeys(packages_to_test):
         # In order to test it, we need a version_argument set
-        if "version_argument" not in constants.CONFIG["packages"][package]:
-            LOG.debug(
-                f"{tool} does not have a version_argument set, we cannot test it..."
-            )
-            continue
-
-        # Add tool packages and helper packages
         if (
-            # The package is the right package for the given tool
-            package == package_for_tool
-            # The package is referenced in the security section of the provided tool
-            or (
-                "security" in constants.CONFIG["packages"][package_for_tool]
-                and package
-                in constants.CONFIG["packages"][package_for_tool]["security"]
-            )
-            # The package "help"s the provided tool
-            or (
-                "helper" in constants.CONFIG["packages"][package]
-                and set(constants.CONFIG["packages"][package]["helper"]).intersection(
-                    {tool, package_for_tool, "all"}
-                )
+            version_argument := compiled_config.packages[package].version_argument
+        ) is None:
+            LOG.debug(
+                f"{package} does not have a version_argument set, we cannot test it..."
             )
-        ):
-            packages_to_test.append(package)
             continue
 
-    commands_to_test: set[str] = set()
-    for package in packages_to_test:
-        if "aliases" in constants.CONFIG["packages"][package]:
-            for alias in constants.CONFIG["packages"][package]["aliases"]:
-                commands_to_test.add(
-                    f'command {alias} {constants.CONFIG["packages"][package]["version_argument"]}'
-                )
-        else:
-            commands_to_test.add(
-                f'command {package} {constants.CONFIG["packages"][package]["version_argument"]}'
-            )
+        for alias in compiled_config.packages[package].aliases:
+            commands_to_test.add(f"command {alias} {version_argument}")
 
     LOG.debug(
         f"Testing the following commands for image {image} as {user}: {commands_to_test}..."
@@ -249,41 +223,19 @@ def run_path_check(
     *, tool: str, user: str, environment: Optional[str] = None, image_and_tag: str
 ) -> None:
     """Wrapper to run check_paths"""
-    commands: list[str] = []
+    compiled_config: config.CompiledConfig = constants.COMPILED_CONFIG
 
-    for package in constants.CONFIG["packages"]:
-        if (
-            # If it's the tool package
-            package == tool
-            # Or if it's a security tool for tool
-            or (
-                tool in constants.CONFIG["packages"]
-                and package in constants.CONFIG["packages"][tool]["security"]
-            )
-            # Or if the tool is a custom name
-            or (
-                "tool" in constants.CONFIG["packages"][package]
-                and "name" in constants.CONFIG["packages"][package]["tool"]
-                and package == constants.CONFIG["packages"][package]["tool"]["name"]
-            )
-            # Or if it's an applicable helper
-            or (
-                "helper" in constants.CONFIG["packages"][package]
-                and set(constants.CONFIG["packages"][package]["helper"]).intersection(
-                    {tool, "all"}
-                )
-            )
-            # Or if it's a tool for the specified environment
-            or (
-                environment
-                and environment in constants.ENVIRONMENTS
-                and package in constants.CONFIG["environments"][environment]["packages"]
-            )
-        ):
-            if "aliases" in constants.CONFIG["packages"][package]:
-                commands += constants.CONFIG["packages"][package]["aliases"]
-            else:
-                commands.append(package)
+    # The tool package, its security tools, its helpers, and the packages for the specified environment
+    package_for_tool: str = utils.get_package_name(tool=tool)
+    packages: list[str] = [package_for_tool]
+    packages.extend(compiled_config.security_tools[package_for_tool])
+    packages.extend(compiled_config.get_helpers(tool=tool))
+    if environment and environment in compiled_config.environments:
+        packages.extend(compiled_config.environment_packages[environment])
+
+    commands: list[str] = []
+    for package in dict.fromkeys(packages):
+        commands += compiled_config.packages[package].aliases
 
     for interactive in [True, False]:
         num_successful_tests: int = check_paths(
@@ -395,6 +347,8 @@ def run_tests(
     tool: str,
     environment: Optional[str],
     mount_local_files: bool = False,
+    cleanup: bool = True,
+    security: bool = True,
 ) -> None:
     """Fanout function to run the appropriate tests"""
     if mount_local_files:
@@ -429,10 +383,12 @@ def run_tests(
 
     # TODO: Fix typing issue here with environment; None vs str
     global_tests(tool=tool, environment=environment, user=user)
-    # No need to supply a user to the security scans as they are container-global
-    run_security(tool=tool, environment=environment, tag=tag)
+    # No need to supply a user to the security scans as they are container-global. The pipeline scans in its own stage
+    if security:
+        run_security(tool=tool, environment=environment, tag=tag)
 
-    if os.getenv("GITHUB_ACTIONS") != "true":
+    # Other images may still be using the build artifacts when the tests are run in a pipeline
+    if not cleanup or os.getenv("GITHUB_ACTIONS") != "true":
         return
 
     # See the warning under https://docs.python.org/3/library/subprocess.html#popen-constructor and some additional context in
@@ -1752,34 +1708,27 @@ def run_aws(*, image: str, user: str, mount_local_files: bool) -> None:
     LOG.info(f"{image} passed {num_tests_ran} integration tests as {user}")
 
 
-def run_security(*, tool: str, environment: str, tag: str) -> None:
+def run_security(
+    *, tool: str, environment: str, tag: str, db_version: Optional[str] = None
+) -> None:
     """Run the security tests"""
-    sbom_file: Path = Path(f"sbom.{tag}.json")
-
-    if not sbom_file.is_file():
-        LOG.debug("Generating an SBOM...")
-        utils.sbom(tool=tool, environment=environment)
+    image_and_tag: str = f"{constants.IMAGE}:{tag}"
+    if db_version is None:
+        db_version = utils.get_vulnerability_db_version()
 
-    # Run a vulnerability scan on the provided SBOM
-    try:
-        LOG.info(f"Running a vulnerability scan on {sbom_file}...")
-        subprocess.run(
-            [
-                "grype",
-                f"sbom:{str(sbom_file)}",
-                "--output",
-                "json",
-                "--file",
-                f"vulns.{tag}.json",
-            ],
-            capture_output=True,
-            check=True,
-        )
-    except subprocess.CalledProcessError as error:
-        LOG.error(
-            f"stdout: {error.stdout.decode('utf-8')}, stderr: {error.stderr.decode('utf-8')}"
-        )
-        sys.exit(1)
+    # Reuses the SBOM from the build, and the results of any prior scan of the same image with the same vulnerability database
+    image: docker.models.images.Image = utils.get_client().images.get(image_and_tag)
+    vulns_file: Path = utils.scan_vulnerabilities(
+        image=image,
+        image_and_tag=image_and_tag,
+        db_version=db_version,
+    )
+    vulns: dict = json.loads(vulns_file.read_text(encoding="UTF-8"))
+    utils.describe_image_source(
+        source=vulns.setdefault("source", {}).setdefault("target", {}),
+        image=image,
+        image_and_tag=image_and_tag,
+    )
+    Path(f"vulns.{tag}.json").write_text(json.dumps(vulns), encoding="UTF-8")
 
-    image_and_tag: str = f"{constants.IMAGE}:{tag}"
     LOG.info(f"{image_and_tag} passed the security tests")